@@ -0,0 +1,79 @@
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+from image_ingest import load_image
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_IN_FLIGHT = 8
+
+Task = Tuple[Optional[Hashable], Callable[..., Any], Tuple[Any, ...], Future]
+
+
+class AssetLoader:
+    '''
+    Decodes assets off the render thread.
+    Requests beyond max_in_flight wait in a queue holding only their arguments, so a
+    large drop cannot hold more than max_in_flight decoded images in flight at once.
+    '''
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> None:
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asset-loader")
+        self._max_in_flight: int = max_in_flight
+        self._in_flight: int = 0
+        self._pending: Deque[Task] = deque()
+        self._by_key: Dict[Hashable, Future] = {}
+        self._lock: Lock = Lock()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def submit(self, fn: Callable[..., Any], *args: Any, key: Optional[Hashable] = None) -> Future:
+        ''' queues fn(*args), requests sharing a key while queued or running share one future '''
+        with self._lock:
+            if key is not None and key in self._by_key:
+                return self._by_key[key]
+            future = Future()
+            if key is not None:
+                self._by_key[key] = future
+            self._pending.append((key, fn, args, future))
+        self._pump()
+        return future
+
+    def load(self, path: str) -> Future:
+        return self.submit(load_image, path, key=path)
+
+    def _pump(self) -> None:
+        with self._lock:
+            while self._pending and self._in_flight < self._max_in_flight:
+                task = self._pending.popleft()
+                self._in_flight += 1
+                self._executor.submit(self._run, *task)
+
+    def _run(self, key: Optional[Hashable], fn: Callable[..., Any], args: Tuple[Any, ...], future: Future) -> None:
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                if key is not None:
+                    self._by_key.pop(key, None)
+            self._pump()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            while self._pending:
+                _, _, _, future = self._pending.popleft()
+                future.cancel()
+            self._by_key.clear()
+        self._executor.shutdown(wait=False)
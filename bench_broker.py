@@ -0,0 +1,70 @@
+from typing import Any, Dict, List
+import asyncio
+import time
+
+import pygame
+from pygame.event import Event as PyGameEvent
+
+from broker import MessageBroker
+from codec import CODECS
+from models import Message, MessageBatch
+
+BATCHES = 5000
+SUBSCRIBER_COUNTS = (1, 2, 4, 8, 16, 32)
+
+
+class NullSocket:
+    ''' stands in for a subscriber connection, accepts frames as fast as the broker writes them '''
+
+    def __init__(self) -> None:
+        self.frames: int = 0
+        self.bytes: int = 0
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        frame = message.get("bytes")
+        if frame is None:
+            # a text frame goes out as UTF-8, the way the transport would put it on the wire
+            frame = message["text"].encode("utf-8")
+        self.frames += 1
+        self.bytes += len(frame)
+
+    async def close(self) -> None:
+        pass
+
+
+def sample_batches() -> List[MessageBatch]:
+    return [
+        MessageBatch(seq=i, messages=[
+            Message(event=PyGameEvent(pygame.MOUSEMOTION, pos=(i % 1280, i % 720), rel=(1, 1), buttons=(1, 0, 0)), seq=i),
+        ])
+        for i in range(BATCHES)
+    ]
+
+
+async def bench(subscribers: int, batches: List[MessageBatch]) -> float:
+    broker = MessageBroker(queue_size=len(batches))
+    sockets = [NullSocket() for _ in range(subscribers)]
+    codecs = list(CODECS.values())
+    for i, socket in enumerate(sockets):
+        await broker.register(socket, codecs[i % len(codecs)])
+
+    start = time.perf_counter()
+    for batch in batches:
+        await broker.publish(batch)
+        # let the writers run the way the server's receive loop would between frames
+        await asyncio.sleep(0)
+    while any(socket.frames < len(batches) for socket in sockets):
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+
+    for socket in sockets:
+        await broker.unregister(socket)
+    return len(batches) / elapsed
+
+
+if __name__ == "__main__":
+    batches = sample_batches()
+    print(f"{'subscribers':>11} {'batches/s':>12} {'frames/s':>12}")
+    for subscribers in SUBSCRIBER_COUNTS:
+        rate = asyncio.run(bench(subscribers, batches))
+        print(f"{subscribers:>11} {rate:>12,.0f} {rate * subscribers:>12,.0f}")
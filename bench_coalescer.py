@@ -0,0 +1,65 @@
+from typing import Callable
+import os
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+from pygame.event import Event as PyGameEvent
+
+from coalescer import EventCoalescer
+from event_queue import PublisherEventQueue
+
+NOTCHES = 20
+MOTIONS = 50
+ROUNDS = 2000
+
+
+def post_wheel_burst(notches: int) -> None:
+    ''' what SDL posts for a fast wheel flick: each notch as button 4 down and up plus a MOUSEWHEEL '''
+    for _ in range(notches):
+        pygame.event.post(PyGameEvent(pygame.MOUSEBUTTONDOWN, button=4, pos=(0, 0)))
+        pygame.event.post(PyGameEvent(pygame.MOUSEBUTTONUP, button=4, pos=(0, 0)))
+        pygame.event.post(PyGameEvent(pygame.MOUSEWHEEL, x=0, y=1, flipped=False, precise_x=0.0, precise_y=1.0))
+
+
+def post_drag(motions: int) -> None:
+    pygame.event.post(PyGameEvent(pygame.MOUSEBUTTONDOWN, button=1, pos=(0, 0)))
+    for i in range(motions):
+        pygame.event.post(PyGameEvent(pygame.MOUSEMOTION, pos=(i, i), rel=(1, 1), buttons=(1, 0, 0)))
+    pygame.event.post(PyGameEvent(pygame.MOUSEBUTTONUP, button=1, pos=(0, 0)))
+
+
+def post_mixed(notches: int, motions: int) -> None:
+    ''' a drag with the wheel flicked halfway through, so neither run coalesces across the other '''
+    post_drag(motions // 2)
+    post_wheel_burst(notches)
+    post_drag(motions // 2)
+
+
+def bench(name: str, post: Callable[[], None]) -> None:
+    queue = PublisherEventQueue()
+    coalescer = EventCoalescer()
+    elapsed = 0.0
+    for _ in range(ROUNDS):
+        # posting stands in for SDL filling the queue and is left out of the timing
+        post()
+        start = time.perf_counter()
+        coalescer.coalesce(queue.get())
+        elapsed += time.perf_counter() - start
+
+    print(
+        f"{name:>8} {coalescer.received // ROUNDS:>10} {coalescer.emitted // ROUNDS:>10} "
+        f"{coalescer.received / elapsed:>12,.0f} {ROUNDS / elapsed:>12,.0f}"
+    )
+
+
+if __name__ == "__main__":
+    pygame.init()
+    pygame.display.set_mode((64, 64))
+    pygame.event.clear()
+
+    print(f"{'burst':>8} {'in/burst':>10} {'out/burst':>10} {'in msg/s':>12} {'bursts/s':>12}")
+    bench("wheel", lambda: post_wheel_burst(NOTCHES))
+    bench("drag", lambda: post_drag(MOTIONS))
+    bench("mixed", lambda: post_mixed(NOTCHES, MOTIONS))
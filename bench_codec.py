@@ -0,0 +1,60 @@
+from typing import List
+import time
+
+import pygame
+from pygame.event import Event as PyGameEvent
+
+import custom_events as CustomPyGameEvents
+from models import Message, MessageBatch
+from codec import Codec, CODECS
+
+ROUNDS = 20000
+
+
+def sample_messages() -> List[Message]:
+    ''' the traffic of a token drag: mostly motion, a few button events and the odd fallback '''
+    messages = []
+    for i in range(100):
+        messages.append(Message(
+            event=PyGameEvent(pygame.MOUSEMOTION, pos=(400 + i, 300 + i // 2), rel=(1, 0), buttons=(1, 0, 0), touch=False),
+        ))
+    messages.append(Message(event=PyGameEvent(CustomPyGameEvents.LEFT_MOUSE_CLICK_DOWN), extra={"pos": (400, 300)}))
+    messages.append(Message(event=PyGameEvent(CustomPyGameEvents.LEFT_MOUSE_CLICK_UP), extra={"pos": (500, 350)}))
+    messages.append(Message(event=PyGameEvent(CustomPyGameEvents.WHEEL_PRESS_UP), extra={"pos": (500, 350)}))
+    messages.append(Message(
+        event=PyGameEvent(CustomPyGameEvents.FOG_REVEAL), extra={"shape": "circle", "params": [812.5, 640.25, 80.0]},
+    ))
+    messages.append(Message(event=PyGameEvent(CustomPyGameEvents.CHANGE_MAP_SPECIFIC), extra={"map": "image_31.jfif"}))
+    for seq, message in enumerate(messages):
+        message.seq = seq
+    return messages
+
+
+def bench(codec: Codec, messages: List[Message]) -> None:
+    frames = [codec.encode(message) for message in messages]
+    size = sum(len(frame.encode() if isinstance(frame, str) else frame) for frame in frames) / len(frames)
+    rounds = max(1, ROUNDS // len(messages))
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            codec.encode(message)
+    encode_rate = rounds * len(messages) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for frame in frames:
+            codec.decode(frame)
+    decode_rate = rounds * len(messages) / (time.perf_counter() - start)
+
+    batch = codec.encode_batch(MessageBatch(seq=0, messages=messages))
+    batch_size = len(batch.encode() if isinstance(batch, str) else batch) / len(messages)
+
+    print(f"{codec.name:>8} {size:>12.1f} {batch_size:>14.1f} {encode_rate:>14,.0f} {decode_rate:>14,.0f}")
+
+
+if __name__ == "__main__":
+    messages = sample_messages()
+    print(f"{'codec':>8} {'bytes/msg':>12} {'batched/msg':>14} {'encode msg/s':>14} {'decode msg/s':>14}")
+    for codec in CODECS.values():
+        bench(codec, messages)
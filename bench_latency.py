@@ -0,0 +1,60 @@
+from typing import List
+from threading import Thread
+import statistics
+import time
+
+import uvicorn
+from pygame.event import Event as PyGameEvent
+
+import custom_events as CustomPyGameEvents
+from server import app
+from publisher import Publisher
+from subscriber import Subscriber
+
+MESSAGES = 500
+INTERVAL = 0.005
+POLL_INTERVAL = 0.0001
+PORT = 8000
+
+
+def start_server() -> None:
+    Thread(target=uvicorn.run, args=(app,), kwargs={"port": PORT, "log_level": "warning"}, daemon=True).start()
+    time.sleep(1.5)
+
+
+def measure(publisher: Publisher, subscriber: Subscriber) -> List[float]:
+    ''' publish to receive latency in ms of single message ticks, paced like a game loop '''
+    latencies = []
+    for i in range(MESSAGES):
+        publisher.publish(PyGameEvent(CustomPyGameEvents.CHANGE_GRID_SIZE), {"size": i, "sent_ns": time.perf_counter_ns()})
+        publisher.flush()
+
+        deadline = time.perf_counter() + 1.0
+        while (batch := subscriber.get()) is None and time.perf_counter() < deadline:
+            # a spinning poll would hold the GIL the network threads need
+            time.sleep(POLL_INTERVAL)
+        if batch is not None:
+            received_ns = time.perf_counter_ns()
+            latencies.extend((received_ns - message.extra["sent_ns"]) / 1e6 for message in batch.messages)
+        time.sleep(INTERVAL)
+    return latencies
+
+
+if __name__ == "__main__":
+    start_server()
+    subscriber = Subscriber()
+    publisher = Publisher()
+    Thread(target=subscriber.start, daemon=True).start()
+    time.sleep(0.5)
+    Thread(target=publisher.start, daemon=True).start()
+    time.sleep(0.5)
+
+    latencies = sorted(measure(publisher, subscriber))
+    publisher.stop()
+    subscriber.stop()
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    print(f"messages {len(latencies)}/{MESSAGES}")
+    print(f"mean {statistics.mean(latencies):.2f} ms  p50 {percentile(0.5):.2f} ms  p95 {percentile(0.95):.2f} ms  p99 {percentile(0.99):.2f} ms")
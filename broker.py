@@ -1,30 +1,267 @@
-from typing import Set
-from queue import Queue, Empty as QueueEmpty
+from typing import Any, Callable, Deque, Dict, List, Optional
+from collections import deque
 import asyncio
+import uuid
+import pygame
 from fastapi import WebSocket
+from common import OverflowPolicy
+from models import MessageBatch
+from codec import Codec, Frame
+from coalescer import EventCoalescer
+from replay import ReplayLog, DEFAULT_REPLAY_SIZE
+from session_state import SessionState
+from obscurers import DEFAULT_FOG_CELL_SIZE
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_RESUME_WINDOW = 1024
+
+
+class Envelope:
+    '''
+    A published batch plus its frames, encoded at most once per codec however many subscribers share it.
+    Text codecs keep their frames as str so they go out as text frames, which clients predating the handshake expect.
+    '''
+
+    def __init__(self, batch: MessageBatch) -> None:
+        self.batch: MessageBatch = batch
+        self._frames: Dict[str, Frame] = {}
+
+    @property
+    def has_motion(self) -> bool:
+        return any(message.event.type == pygame.MOUSEMOTION for message in self.batch.messages)
+
+    def without_motion(self) -> Optional["Envelope"]:
+        messages = [message for message in self.batch.messages if message.event.type != pygame.MOUSEMOTION]
+        if not messages:
+            return None
+        return Envelope(MessageBatch(seq=self.batch.seq, version=self.batch.version, messages=messages))
+
+    def frame(self, codec: Codec) -> Frame:
+        frame = self._frames.get(codec.name)
+        if frame is None:
+            frame = codec.encode_batch(self.batch)
+            self._frames[codec.name] = frame
+        return frame
+
+
+class SubscriberChannel:
+    '''
+    Outbound queue of one subscriber, drained by its own writer task so a slow socket only delays itself.
+    When the queue is full the overflow policy decides what gives: the oldest motion, the whole backlog
+    coalesced into one batch, or the subscriber's connection.
+    '''
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        codec: Codec,
+        max_size: int = DEFAULT_QUEUE_SIZE,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST_MOTION,
+        on_disconnect: Optional[Callable[["SubscriberChannel"], Any]] = None,
+    ) -> None:
+        self.websocket: WebSocket = websocket
+        self.codec: Codec = codec
+        self.max_size: int = max_size
+        self.policy: OverflowPolicy = policy
+        self._on_disconnect = on_disconnect
+
+        self._queue: Deque[Envelope] = deque()
+        # set only while the writer sleeps on an empty queue, so a busy writer costs put() nothing
+        self._waiter: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self.closed: bool = False
+
+        self.sent: int = 0
+        self.dropped: int = 0
+        self.coalesced: int = 0
+        self.max_depth: int = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "codec": self.codec.name,
+            "policy": self.policy.value,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._write())
+
+    def put(self, envelope: Envelope) -> None:
+        if self.closed:
+            return
+        if len(self._queue) >= self.max_size and not self._make_room():
+            return
+        self._queue.append(envelope)
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._wake()
+
+    def _make_room(self) -> bool:
+        ''' applies the overflow policy, returns False when the envelope should not be queued '''
+        if self.policy == OverflowPolicy.DISCONNECT:
+            self.close()
+            return False
+
+        if self.policy == OverflowPolicy.DROP_OLDEST_MOTION and self._drop_oldest_motion():
+            return True
+
+        # nothing left to drop, or asked to coalesce: fold the backlog into a single batch
+        messages = [message for queued in self._queue for message in queued.batch.messages]
+        coalesced = EventCoalescer().coalesce(messages)
+        self.coalesced += len(messages) - len(coalesced)
+        last = self._queue[-1].batch
+        self._queue.clear()
+        self._queue.append(Envelope(MessageBatch(seq=last.seq, version=last.version, messages=coalesced)))
+        return True
+
+    def _drop_oldest_motion(self) -> bool:
+        ''' strips motion from the oldest batches until one empties, returns True once there is room '''
+        kept: Deque[Envelope] = deque()
+        while self._queue and len(kept) + len(self._queue) >= self.max_size:
+            queued = self._queue.popleft()
+            remaining = queued.without_motion() if queued.has_motion else queued
+            self.dropped += len(queued.batch.messages) - (len(remaining.batch.messages) if remaining else 0)
+            if remaining is not None:
+                kept.append(remaining)
+        self._queue.extendleft(reversed(kept))
+        return len(self._queue) < self.max_size
+
+    def _wake(self) -> None:
+        if self._waiter is not None:
+            if not self._waiter.done():
+                self._waiter.set_result(None)
+            self._waiter = None
+
+    async def _write(self) -> None:
+        send = self.websocket.send
+        try:
+            while not self.closed:
+                if not self._queue:
+                    self._waiter = asyncio.get_running_loop().create_future()
+                    await self._waiter
+                    continue
+                envelope = self._queue.popleft()
+                # the shared frame goes straight to the ASGI connection, no per-socket encoding
+                frame = envelope.frame(self.codec)
+                if isinstance(frame, str):
+                    await send({"type": "websocket.send", "text": frame})
+                else:
+                    await send({"type": "websocket.send", "bytes": frame})
+                self.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error while sending to subscriber: {e}")
+        finally:
+            self.close()
+
+    def close(self, close_socket: bool = True) -> None:
+        ''' ends the channel, close_socket=False when the client already hung up '''
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._wake()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        if close_socket:
+            # the client must see the end of the channel, or it would wait on a socket nobody writes to
+            asyncio.ensure_future(self._close_socket())
+        if self._on_disconnect is not None:
+            self._on_disconnect(self)
+
+
+    async def _close_socket(self) -> None:
+        try:
+            await self.websocket.close()
+        except Exception as e:
+            # the connection went away in between, there is nothing left to close
+            print(f"Error while closing subscriber: {e}")
 
 
 class MessageBroker:
-    def __init__(self) -> None:
-        self._subscribers: Set[WebSocket] = set()
-        self._message_queue: Queue[str] = Queue()
+    def __init__(
+        self,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST_MOTION,
+        replay_size: int = DEFAULT_REPLAY_SIZE,
+        resume_window: int = DEFAULT_RESUME_WINDOW,
+        fog_cell_size: int = DEFAULT_FOG_CELL_SIZE,
+    ) -> None:
+        self._queue_size: int = queue_size
+        self._policy: OverflowPolicy = policy
+        self._subscribers: Dict[WebSocket, SubscriberChannel] = {}
+        self._replay: ReplayLog = ReplayLog(replay_size, fog_cell_size)
+        # every batch fanned out gets the next seq, whatever the publisher numbered it,
+        # counted within an epoch that is new for every broker instance
+        self.epoch: str = uuid.uuid4().hex
+        self._seq: int = -1
+        # the latest envelopes, frames included, for subscribers resuming after a dropped connection
+        self._recent: Deque[Envelope] = deque(maxlen=resume_window)
+
+    async def register(
+        self, websocket: WebSocket, codec: Codec, resume_from: Optional[int] = None, epoch: Optional[str] = None
+    ) -> None:
+        channel = SubscriberChannel(
+            websocket, codec, self._queue_size, self._policy, on_disconnect=self._drop_channel
+        )
+        self._subscribers[websocket] = channel
+        channel.start()
+
+        # a resuming subscriber gets the batches it missed, if they are all still here and fit its queue
+        missed = self._missed_since(resume_from, epoch)
+        if missed is not None and len(missed) < channel.max_size:
+            for envelope in missed:
+                channel.put(envelope)
+            return
+
+        # anyone else catches up in one burst, later batches queue up behind it
+        replay = self._replay.replay()
+        if replay is not None:
+            channel.put(Envelope(replay))
 
-    async def register(self, websocket: WebSocket) -> None:
-        self._subscribers.add(websocket)
+    def _missed_since(self, seq: Optional[int], epoch: Optional[str]) -> Optional[List[Envelope]]:
+        ''' envelopes published after seq, None when the gap reaches past the resume window '''
+        if seq is None or epoch != self.epoch or seq > self._seq:
+            # a new subscriber, or one whose seq was counted by an earlier broker
+            return None
+        if seq == self._seq:
+            return []
+        if not self._recent or self._recent[0].batch.seq > seq + 1:
+            return None
+        return [envelope for envelope in self._recent if envelope.batch.seq > seq]
 
     async def unregister(self, websocket: WebSocket) -> None:
-        self._subscribers.remove(websocket)
-
-    async def publish(self, message: str) -> None:
-        if self._subscribers:
-            try:
-                while queued_message := self._message_queue.get_nowait():
-                    await asyncio.wait(
-                        [ws.send_text(queued_message) for ws in self._subscribers]
-                    )
-            except QueueEmpty:
-                pass
-
-            await asyncio.wait([ws.send_text(message) for ws in self._subscribers])
-        else:
-            self._message_queue.put_nowait(message)
+        channel = self._subscribers.pop(websocket, None)
+        if channel is not None:
+            # only called once the client disconnected, its socket is already closed
+            channel.close(close_socket=False)
+
+    def _drop_channel(self, channel: SubscriberChannel) -> None:
+        if self._subscribers.get(channel.websocket) is channel:
+            del self._subscribers[channel.websocket]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [channel.stats() for channel in self._subscribers.values()]
+
+    @property
+    def state(self) -> SessionState:
+        return self._replay.state
+
+    async def publish(self, batch: MessageBatch) -> None:
+        self._seq += 1
+        batch.seq = self._seq
+        # recording tags the batch with the state version, before any codec encodes it
+        self._replay.record(batch)
+        envelope = Envelope(batch)
+        self._recent.append(envelope)
+        # queued, never awaited, the publisher does not wait for any subscriber's socket
+        for channel in list(self._subscribers.values()):
+            channel.put(envelope)
@@ -1,10 +1,24 @@
 from __future__ import annotations
-from typing import List
+from typing import Dict, List, Optional
+from math import ceil, floor
 
 import pygame
 from pygame import Vector2
 import custom_events as CustomPyGameEvents
 from models import Message
+from render_scheduler import RenderScheduler
+from spatial_index import SpatialHash, Bounds
+from event_dispatcher import EventDispatcher
+from coalescer import wheel_count
+from token_store import TokenStore
+
+WHEEL_PRESS_EVENTS = (CustomPyGameEvents.WHEEL_PRESS_DOWN, CustomPyGameEvents.WHEEL_PRESS_UP)
+
+
+def wheel_scale(message: Message) -> float:
+    ''' zoom factor of a wheel message, coalesced messages carry the number of notches '''
+    scale_value = 1.1 if message.event.type == CustomPyGameEvents.WHEEL_PRESS_UP else 0.9
+    return scale_value ** wheel_count(message)
 
 
 class MapEntity:
@@ -21,36 +35,96 @@ class MapEntity:
         self.mouse_world_to_self = Vector2()
         self.canvas = canvas
 
+    def subscribe(self, dispatcher: EventDispatcher) -> None:
+        ''' registers handlers for the event types this entity reacts to '''
+        if self.draggable:
+            dispatcher.subscribe(CustomPyGameEvents.LEFT_MOUSE_CLICK_DOWN, self._on_drag_start, self)
+            dispatcher.subscribe(CustomPyGameEvents.LEFT_MOUSE_CLICK_UP, self._on_drag_end, self)
+            dispatcher.subscribe(pygame.MOUSEMOTION, self._on_drag_motion, self)
+        if self.scaleable:
+            for event_type in WHEEL_PRESS_EVENTS:
+                dispatcher.subscribe(event_type, self._on_wheel, self)
+
     def handle_event(self, message: Message):
         event = message.event
-        extra = message.extra
 
         if self.selected:
             # drag
             if self.draggable:
                 if event.type == CustomPyGameEvents.LEFT_MOUSE_CLICK_DOWN:
-                    self.is_dragging = True
-                    mouse_in_world = (Vector2(extra['pos']) - self.canvas.cam) / self.canvas.scale
-                    self.mouse_world_to_self = self.pos - mouse_in_world
+                    self._on_drag_start(message)
 
                 if event.type == CustomPyGameEvents.LEFT_MOUSE_CLICK_UP:
-                    self.is_dragging = False
+                    self._on_drag_end(message)
 
-                if event.type == pygame.MOUSEMOTION and self.is_dragging:
-                    mouse_in_world = (Vector2(extra['pos']) - self.canvas.cam) / self.canvas.scale
-                    self.pos = mouse_in_world + self.mouse_world_to_self
+                if event.type == pygame.MOUSEMOTION:
+                    self._on_drag_motion(message)
 
             # scale
             if self.scaleable:
-                if event.type in (CustomPyGameEvents.WHEEL_PRESS_DOWN, CustomPyGameEvents.WHEEL_PRESS_UP):
-                    scale_value = 1.1 if event.type == CustomPyGameEvents.WHEEL_PRESS_UP else 0.9
-                    self.scale *= scale_value
-                    self.update_scale()
+                if event.type in WHEEL_PRESS_EVENTS:
+                    self._on_wheel(message)
 
-        # check for selection
+        # check for selection, indexed entities are hovered by the canvas
         if event.type == pygame.MOUSEMOTION:
-            if self.selectable:
-                self.check_if_selected(extra['pos'])
+            if self.selectable and self not in self.canvas.index:
+                was_selected = self.selected
+                self.check_if_selected(event.pos)
+                if self.selected != was_selected:
+                    self.invalidate()
+
+    def _on_drag_start(self, message: Message) -> None:
+        self.is_dragging = True
+        mouse_in_world = self.canvas.mouse_in_world(message.extra['pos'])
+        self.mouse_world_to_self = self.pos - mouse_in_world
+        self.canvas.dispatcher.capture(self)
+
+    def _on_drag_end(self, message: Message) -> None:
+        self.is_dragging = False
+        self.canvas.dispatcher.release(self)
+
+    def _on_drag_motion(self, message: Message) -> None:
+        if not self.is_dragging:
+            return
+        mouse_in_world = self.canvas.mouse_in_world(message.event.pos)
+        self.invalidate()
+        self.pos = mouse_in_world + self.mouse_world_to_self
+        self.invalidate()
+        self.update_bounds()
+
+    def _on_wheel(self, message: Message) -> None:
+        scale_value = wheel_scale(message)
+        self.invalidate()
+        self.scale *= scale_value
+        self.update_scale()
+        self.invalidate()
+        self.update_bounds()
+
+    def set_transform(self, pos: Vector2, scale: float) -> None:
+        ''' jumps to a position and scale decided elsewhere, the DM's state after a gesture '''
+        self.invalidate()
+        self.pos = Vector2(pos)
+        self.scale = scale
+        self.update_scale()
+        self.invalidate()
+        self.update_bounds()
+
+    def screen_rect(self) -> Optional[pygame.Rect]:
+        ''' area the entity covers on screen, None when it may cover the whole window '''
+        return None
+
+    def invalidate(self) -> None:
+        self.canvas.invalidate(self.screen_rect())
+
+    def world_bounds(self) -> Optional[Bounds]:
+        ''' world space bounds used for picking, None keeps the entity out of the canvas index '''
+        return None
+
+    def update_bounds(self) -> None:
+        self.canvas.update_entity_bounds(self)
+
+    def hit_test(self, mouse_pos: Vector2) -> bool:
+        return True
 
     def check_if_selected(self, mouse_pos: Vector2) -> None:
         ...
@@ -61,6 +135,9 @@ class MapEntity:
     def update_canvas_scale(self, win: pygame.Surface) -> None:
         ...
 
+    def step(self) -> None:
+        ...
+
 
 
 class Canvas:
@@ -71,35 +148,126 @@ class Canvas:
         self._is_dragging = False
         self._mouse_to_cam: Vector2 = None
         self.entities: List[MapEntity] = []
+        self.scheduler: RenderScheduler = None
+        self.tokens = TokenStore()
+
+        # world space index of entity bounds, kept up to date as entities move or scale
+        self.index = SpatialHash()
+        self.hovered: Optional[MapEntity] = None
+        self._order: Dict[MapEntity, int] = {}
+
+        # pointer events nobody under the mouse handles move the camera
+        self.dispatcher = EventDispatcher(default_owner=self)
+        for event_type in WHEEL_PRESS_EVENTS:
+            self.dispatcher.subscribe(event_type, self._on_wheel, self)
+        self.dispatcher.subscribe(CustomPyGameEvents.LEFT_MOUSE_CLICK_DOWN, self._on_drag_start, self)
+        self.dispatcher.subscribe(CustomPyGameEvents.LEFT_MOUSE_CLICK_UP, self._on_drag_end, self)
+        self.dispatcher.subscribe(pygame.MOUSEMOTION, self._on_drag_motion, self)
 
     def register_map_entity(self, entity: MapEntity) -> None:
+        self._order[entity] = len(self.entities)
         self.entities.append(entity)
+        entity.subscribe(self.dispatcher)
+        entity.update_bounds()
+        entity.invalidate()
+
+    def dispatch(self, message: Message) -> bool:
+        if message.event.type == pygame.MOUSEMOTION and self.dispatcher.captured_by is None:
+            self.dispatcher.focus = self.update_hover(message.event.pos)
+        return self.dispatcher.dispatch(message)
+
+    def update_entity_bounds(self, entity: MapEntity) -> None:
+        bounds = entity.world_bounds()
+        if bounds is None or entity not in self._order:
+            self.index.remove(entity)
+        else:
+            self.index.update(entity, bounds)
+
+    def pick(self, mouse_pos: Vector2) -> Optional[MapEntity]:
+        ''' topmost selectable entity under the mouse '''
+        candidates = [
+            entity
+            for entity in self.index.query_point(self.mouse_in_world(mouse_pos))
+            if entity.selectable and entity.hit_test(mouse_pos)
+        ]
+        return max(candidates, key=self._order.get, default=None)
+
+    def update_hover(self, mouse_pos: Vector2) -> Optional[MapEntity]:
+        if self.hovered is not None and self.hovered.is_dragging:
+            return self.hovered
+
+        hovered = self.pick(mouse_pos)
+        if hovered is not self.hovered:
+            if self.hovered is not None:
+                self.hovered.selected = False
+                self.hovered.invalidate()
+            if hovered is not None:
+                hovered.selected = True
+                hovered.invalidate()
+            self.hovered = hovered
+        return hovered
+
+    def invalidate(self, rect: Optional[pygame.Rect] = None) -> None:
+        if self.scheduler is not None:
+            self.scheduler.invalidate(rect)
 
     def handle_event(self, message: Message) -> None:
         event = message.event
-        extra = message.extra
-
-        if event.type in (CustomPyGameEvents.WHEEL_PRESS_DOWN, CustomPyGameEvents.WHEEL_PRESS_UP):
-                scale_value = 1.1 if event.type == CustomPyGameEvents.WHEEL_PRESS_UP else 0.9
-                mouse_pos = Vector2(extra['pos'])
-                mouse_to_cam = (self.cam - mouse_pos) * scale_value
 
-                self.cam = mouse_pos + mouse_to_cam
-                self.scale *= scale_value
-                for entity in self.entities:
-                    entity.update_canvas_scale(self)
+        if event.type in WHEEL_PRESS_EVENTS:
+            self._on_wheel(message)
 
         elif event.type == CustomPyGameEvents.LEFT_MOUSE_CLICK_DOWN:
-            self._is_dragging = True
-            self._mouse_to_cam = self.cam - Vector2(extra['pos'])
+            self._on_drag_start(message)
 
         elif event.type == CustomPyGameEvents.LEFT_MOUSE_CLICK_UP:
-            self._is_dragging = False
+            self._on_drag_end(message)
 
         elif event.type == pygame.MOUSEMOTION:
-            if self._is_dragging:
-                mouse_pos = Vector2(event.pos)
-                self.cam = mouse_pos + self._mouse_to_cam
+            self._on_drag_motion(message)
+
+    def _on_wheel(self, message: Message) -> None:
+        scale_value = wheel_scale(message)
+        mouse_pos = Vector2(message.extra['pos'])
+        mouse_to_cam = (self.cam - mouse_pos) * scale_value
+
+        self.cam = mouse_pos + mouse_to_cam
+        self.scale *= scale_value
+        for entity in self.entities:
+            entity.update_canvas_scale(self)
+        self.invalidate()
+
+    def _on_drag_start(self, message: Message) -> None:
+        self._is_dragging = True
+        self._mouse_to_cam = self.cam - Vector2(message.extra['pos'])
+        self.dispatcher.capture(self)
+
+    def _on_drag_end(self, message: Message) -> None:
+        self._is_dragging = False
+        self.dispatcher.release(self)
+
+    def _on_drag_motion(self, message: Message) -> None:
+        if self._is_dragging:
+            mouse_pos = Vector2(message.event.pos)
+            self.cam = mouse_pos + self._mouse_to_cam
+            self.invalidate()
+
+    def set_camera(self, cam: Vector2, scale: float) -> None:
+        cam = Vector2(cam)
+        if cam == self.cam and scale == self.scale:
+            return
+        self.cam = cam
+        if scale != self.scale:
+            self.scale = scale
+            for entity in self.entities:
+                entity.update_canvas_scale(self)
+        self.invalidate()
+
+    def world_to_screen_rect(self, bounds: Bounds) -> pygame.Rect:
+        x0, y0, x1, y1 = bounds
+        left, top = self.cam + Vector2(x0, y0) * self.scale
+        right, bottom = self.cam + Vector2(x1, y1) * self.scale
+        return pygame.Rect(floor(left), floor(top), ceil(right) - floor(left), ceil(bottom) - floor(top))
 
     def mouse_in_world(self, mouse_in_win: Vector2) -> Vector2:
         mouse_in_world = (Vector2(mouse_in_win) - self.cam) / self.scale
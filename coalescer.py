@@ -0,0 +1,92 @@
+from typing import Dict, List
+
+import pygame
+from pygame.event import Event as PyGameEvent
+
+import custom_events as CustomPyGameEvents
+from models import Message
+
+WHEEL_RELEASE_OF = {
+    CustomPyGameEvents.WHEEL_PRESS_UP: CustomPyGameEvents.WHEEL_RELEASE_UP,
+    CustomPyGameEvents.WHEEL_PRESS_DOWN: CustomPyGameEvents.WHEEL_RELEASE_DOWN,
+}
+
+
+def wheel_count(message: Message) -> int:
+    ''' notches a wheel message stands for, more than one once coalesced '''
+    return (message.extra or {}).get("count", 1)
+
+
+class EventCoalescer:
+    '''
+    Shrinks a tick's messages before they are handled and published.
+    A run of consecutive motion events becomes the last one with the summed rel, and repeated
+    wheel notches at the same position become one press carrying a count followed by one release.
+    Any other event ends a run, so motion and wheel stay ordered against button presses.
+    '''
+
+    def __init__(self) -> None:
+        self.received: int = 0
+        self.emitted: int = 0
+        self.motion_coalesced: int = 0
+        self.wheel_coalesced: int = 0
+
+    @property
+    def coalesced(self) -> int:
+        return self.received - self.emitted
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "received": self.received,
+            "emitted": self.emitted,
+            "motion_coalesced": self.motion_coalesced,
+            "wheel_coalesced": self.wheel_coalesced,
+        }
+
+    def coalesce(self, messages: List[Message]) -> List[Message]:
+        output: List[Message] = []
+        for message in messages:
+            event_type = message.event.type
+            if event_type == pygame.MOUSEMOTION and self._merge_motion(output, message):
+                self.motion_coalesced += 1
+            elif event_type in WHEEL_RELEASE_OF and self._merge_wheel(output, message):
+                self.wheel_coalesced += 1
+            else:
+                output.append(message)
+
+        self.received += len(messages)
+        self.emitted += len(output)
+        return output
+
+    @staticmethod
+    def _merge_motion(output: List[Message], message: Message) -> bool:
+        last = output[-1] if output else None
+        if last is None or last.event.type != pygame.MOUSEMOTION or last.extra != message.extra:
+            return False
+
+        event, previous = message.event, last.event
+        attributes = dict(event.__dict__)
+        if "rel" in attributes and "rel" in previous.__dict__:
+            attributes["rel"] = (previous.rel[0] + event.rel[0], previous.rel[1] + event.rel[1])
+        output[-1] = Message(event=PyGameEvent(pygame.MOUSEMOTION, attributes), extra=message.extra, seq=message.seq)
+        return True
+
+    @staticmethod
+    def _merge_wheel(output: List[Message], message: Message) -> bool:
+        # the notches arrive as press, release, press, release, ... folded into press(count), release
+        press = output[-2] if len(output) >= 2 else None
+        release = output[-1] if output else None
+        if (
+            press is None
+            or press.event.type != message.event.type
+            or release.event.type != WHEEL_RELEASE_OF[message.event.type]
+            or (press.extra or {}).get("pos") != (message.extra or {}).get("pos")
+        ):
+            return False
+
+        output.pop()
+        extra = dict(press.extra or {})
+        extra["count"] = wheel_count(press) + wheel_count(message)
+        output[-1] = Message(event=press.event, extra=extra, seq=press.seq)
+        return True
+
@@ -0,0 +1,303 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from abc import ABC, abstractmethod
+import json
+import struct
+
+import pygame
+from pygame.event import Event as PyGameEvent
+
+import custom_events as CustomPyGameEvents
+from models import Message, MessageBatch
+
+Frame = Union[str, bytes]
+
+# frame kind, event type, sequence number
+HEADER = struct.Struct("<BHI")
+KIND_PACKED = 1
+KIND_JSON = 2
+# a batch header carries the batch seq and is followed by the state version, each message follows prefixed with its length
+KIND_BATCH = 3
+BATCH_VERSION = struct.Struct("<I")
+BATCH_ITEM = struct.Struct("<I")
+NO_SEQ = 0xFFFFFFFF
+
+
+class PayloadSchema(ABC):
+    ''' fixed binary layout for the messages of one event type '''
+
+    @abstractmethod
+    def matches(self, message: Message) -> bool:
+        pass
+
+    @abstractmethod
+    def pack(self, message: Message) -> bytes:
+        pass
+
+    @abstractmethod
+    def unpack(self, event_type: int, payload: memoryview) -> Tuple[PyGameEvent, Optional[Dict[str, Any]]]:
+        pass
+
+
+class PointerSchema(PayloadSchema):
+    ''' mouse buttons translated by PublisherEventQueue, an empty event with the pointer position in extra '''
+
+    layout = struct.Struct("<ii")
+
+    def matches(self, message: Message) -> bool:
+        return not message.event.__dict__ and message.extra is not None and message.extra.keys() == {"pos"}
+
+    def pack(self, message: Message) -> bytes:
+        x, y = message.extra["pos"]
+        return self.layout.pack(int(x), int(y))
+
+    def unpack(self, event_type: int, payload: memoryview) -> Tuple[PyGameEvent, Optional[Dict[str, Any]]]:
+        x, y = self.layout.unpack(payload)
+        return PyGameEvent(event_type), {"pos": [x, y]}
+
+
+class WheelSchema(PayloadSchema):
+    ''' wheel notches, the pointer position and how many notches were coalesced '''
+
+    layout = struct.Struct("<iiH")
+
+    def matches(self, message: Message) -> bool:
+        extra = message.extra
+        return (
+            not message.event.__dict__
+            and extra is not None
+            and "pos" in extra
+            and extra.keys() <= {"pos", "count"}
+            and extra.get("count", 1) <= 0xFFFF
+        )
+
+    def pack(self, message: Message) -> bytes:
+        x, y = message.extra["pos"]
+        return self.layout.pack(int(x), int(y), message.extra.get("count", 1))
+
+    def unpack(self, event_type: int, payload: memoryview) -> Tuple[PyGameEvent, Optional[Dict[str, Any]]]:
+        x, y, count = self.layout.unpack(payload)
+        extra = {"pos": [x, y]}
+        if count != 1:
+            extra["count"] = count
+        return PyGameEvent(event_type), extra
+
+
+class MotionSchema(PayloadSchema):
+    ''' raw pygame mouse motion, pos, rel and the three button states '''
+
+    layout = struct.Struct("<iiiiBBB")
+    keys = {"pos", "rel", "buttons"}
+    # attributes pygame attaches that carry nothing the other screen uses
+    ignored = {"touch", "window"}
+
+    def matches(self, message: Message) -> bool:
+        keys = message.event.__dict__.keys()
+        return message.extra is None and self.keys <= keys and keys <= self.keys | self.ignored
+
+    def pack(self, message: Message) -> bytes:
+        event = message.event
+        return self.layout.pack(*map(int, event.pos), *map(int, event.rel), *map(int, event.buttons))
+
+    def unpack(self, event_type: int, payload: memoryview) -> Tuple[PyGameEvent, Optional[Dict[str, Any]]]:
+        x, y, dx, dy, left, middle, right = self.layout.unpack(payload)
+        return PyGameEvent(event_type, pos=(x, y), rel=(dx, dy), buttons=(left, middle, right), touch=False), None
+
+
+class FogSchema(PayloadSchema):
+    ''' fog of war brush, shape id followed by its params as float32 '''
+
+    shapes = ("rect", "circle", "polygon")
+    layout = struct.Struct("<BH")
+
+    def matches(self, message: Message) -> bool:
+        extra = message.extra
+        return (
+            not message.event.__dict__
+            and extra is not None
+            and extra.keys() == {"shape", "params"}
+            and extra["shape"] in self.shapes
+        )
+
+    def pack(self, message: Message) -> bytes:
+        params = message.extra["params"]
+        shape = self.shapes.index(message.extra["shape"])
+        return self.layout.pack(shape, len(params)) + struct.pack(f"<{len(params)}f", *params)
+
+    def unpack(self, event_type: int, payload: memoryview) -> Tuple[PyGameEvent, Optional[Dict[str, Any]]]:
+        shape, count = self.layout.unpack_from(payload)
+        params = struct.unpack_from(f"<{count}f", payload, self.layout.size)
+        return PyGameEvent(event_type), {"shape": self.shapes[shape], "params": [round(value, 2) for value in params]}
+
+
+_pointer = PointerSchema()
+_fog = FogSchema()
+
+SCHEMAS: Dict[int, PayloadSchema] = {
+    pygame.MOUSEMOTION: MotionSchema(),
+    CustomPyGameEvents.LEFT_MOUSE_CLICK_DOWN: _pointer,
+    CustomPyGameEvents.LEFT_MOUSE_CLICK_UP: _pointer,
+    CustomPyGameEvents.MIDDLE_MOUSE_CLICK_DOWN: _pointer,
+    CustomPyGameEvents.MIDDLE_MOUSE_CLICK_UP: _pointer,
+    CustomPyGameEvents.RIGHT_MOUSE_CLICK_DOWN: _pointer,
+    CustomPyGameEvents.RIGHT_MOUSE_CLICK_UP: _pointer,
+    CustomPyGameEvents.WHEEL_PRESS_DOWN: WheelSchema(),
+    CustomPyGameEvents.WHEEL_PRESS_UP: WheelSchema(),
+    CustomPyGameEvents.WHEEL_RELEASE_DOWN: _pointer,
+    CustomPyGameEvents.WHEEL_RELEASE_UP: _pointer,
+    CustomPyGameEvents.FOG_REVEAL: _fog,
+    CustomPyGameEvents.FOG_HIDE: _fog,
+}
+
+
+class Codec(ABC):
+    name: str
+
+    @abstractmethod
+    def encode(self, message: Message) -> Frame:
+        pass
+
+    @abstractmethod
+    def decode(self, frame: Frame) -> Message:
+        pass
+
+    @abstractmethod
+    def encode_batch(self, batch: MessageBatch) -> Frame:
+        pass
+
+    @abstractmethod
+    def decode_batch(self, frame: Frame) -> MessageBatch:
+        ''' a batch frame, or a single message frame as a batch of one '''
+        pass
+
+
+class JsonCodec(Codec):
+    ''' the original text frames, understood by every client '''
+
+    name = "json"
+
+    def encode(self, message: Message) -> Frame:
+        return message.model_dump_json()
+
+    def decode(self, frame: Frame) -> Message:
+        return Message.model_validate_json(frame)
+
+    def encode_batch(self, batch: MessageBatch) -> Frame:
+        return batch.model_dump_json()
+
+    def decode_batch(self, frame: Frame) -> MessageBatch:
+        frame_dict = json.loads(frame)
+        if "batch" in frame_dict:
+            return MessageBatch.from_dict(frame_dict)
+        return MessageBatch(messages=[Message.from_dict(frame_dict)])
+
+
+class BinaryCodec(Codec):
+    '''
+    A fixed header with the frame kind, event type and sequence number, followed by a payload
+    packed with the event type's schema. Messages no schema fits carry their event dict and
+    extra as a JSON payload instead.
+    '''
+
+    name = "binary"
+
+    def __init__(self, schemas: Dict[int, PayloadSchema] = SCHEMAS) -> None:
+        self._schemas: Dict[int, PayloadSchema] = schemas
+
+    def encode(self, message: Message) -> Frame:
+        event = message.event
+        seq = NO_SEQ if message.seq is None else message.seq & 0xFFFFFFFF
+        schema = self._schemas.get(event.type)
+        if schema is not None and schema.matches(message):
+            return HEADER.pack(KIND_PACKED, event.type, seq) + schema.pack(message)
+
+        payload = json.dumps({"dict": event.__dict__, "extra": message.extra}).encode()
+        return HEADER.pack(KIND_JSON, event.type, seq) + payload
+
+    def decode(self, frame: Frame) -> Message:
+        kind, event_type, seq = HEADER.unpack_from(frame)
+        payload = memoryview(frame)[HEADER.size:]
+        if kind == KIND_PACKED:
+            event, extra = self._schemas[event_type].unpack(event_type, payload)
+        elif kind == KIND_JSON:
+            body = json.loads(bytes(payload))
+            event, extra = PyGameEvent(event_type, body["dict"]), body["extra"]
+        else:
+            raise ValueError(f"Unknown frame kind: {kind}")
+        return Message(event=event, extra=extra, seq=None if seq == NO_SEQ else seq)
+
+    def encode_batch(self, batch: MessageBatch) -> Frame:
+        seq = NO_SEQ if batch.seq is None else batch.seq & 0xFFFFFFFF
+        version = NO_SEQ if batch.version is None else batch.version & 0xFFFFFFFF
+        parts = [HEADER.pack(KIND_BATCH, 0, seq), BATCH_VERSION.pack(version)]
+        for message in batch.messages:
+            frame = self.encode(message)
+            parts.append(BATCH_ITEM.pack(len(frame)))
+            parts.append(frame)
+        return b"".join(parts)
+
+    def decode_batch(self, frame: Frame) -> MessageBatch:
+        kind, _, seq = HEADER.unpack_from(frame)
+        if kind != KIND_BATCH:
+            return MessageBatch(messages=[self.decode(frame)])
+
+        view = memoryview(frame)
+        messages = []
+        (version,) = BATCH_VERSION.unpack_from(view, HEADER.size)
+        offset = HEADER.size + BATCH_VERSION.size
+        while offset < len(view):
+            (length,) = BATCH_ITEM.unpack_from(view, offset)
+            offset += BATCH_ITEM.size
+            messages.append(self.decode(view[offset:offset + length]))
+            offset += length
+        return MessageBatch(
+            seq=None if seq == NO_SEQ else seq, version=None if version == NO_SEQ else version, messages=messages
+        )
+
+
+CODECS: Dict[str, Codec] = {codec.name: codec for codec in (BinaryCodec(), JsonCodec())}
+DEFAULT_CODEC = CODECS[JsonCodec.name]
+PREFERRED_CODECS: List[str] = [BinaryCodec.name, JsonCodec.name]
+
+
+def hello_frame(
+    codecs: Sequence[str] = PREFERRED_CODECS, resume_from: Optional[int] = None, epoch: Optional[str] = None
+) -> str:
+    '''
+    first frame a client sends, the codecs it speaks in order of preference and,
+    for a subscriber reconnecting, the seq of the last batch it received and the broker epoch that seq belongs to
+    '''
+    hello: Dict[str, Any] = {"codecs": list(codecs)}
+    if resume_from is not None:
+        hello["resume_from"] = resume_from
+        hello["epoch"] = epoch
+    return json.dumps({"hello": hello})
+
+
+def parse_hello(frame: Frame) -> Optional[Dict[str, Any]]:
+    if not isinstance(frame, str):
+        return None
+    try:
+        hello = json.loads(frame).get("hello")
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(hello, dict):
+        return None
+    return hello
+
+
+def select_codec(offered: Sequence[str]) -> Codec:
+    ''' the first codec the client offered that the server knows, JSON otherwise '''
+    for name in offered:
+        if name in CODECS:
+            return CODECS[name]
+    return DEFAULT_CODEC
+
+
+def accept_frame(codec: Codec, epoch: Optional[str] = None) -> str:
+    ''' the server's answer, the codec it picked and the epoch its batch seqs count in '''
+    return json.dumps({"codec": codec.name, "epoch": epoch})
+
+
+def parse_accept(frame: Frame) -> Tuple[Codec, Optional[str]]:
+    accept = json.loads(frame)
+    return CODECS.get(accept.get("codec"), DEFAULT_CODEC), accept.get("epoch")
@@ -23,3 +23,9 @@ class GridColors(Tuple, Enum):
     GRAY = (128, 128, 128)
 
 
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST_MOTION = "drop_oldest_motion"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
@@ -25,4 +25,11 @@ RIGHT_MOUSE_CLICK_UP: int = pg.USEREVENT + counter.__next__()
 WHEEL_PRESS_DOWN: int = pg.USEREVENT + counter.__next__()
 WHEEL_PRESS_UP: int = pg.USEREVENT + counter.__next__()
 WHEEL_RELEASE_DOWN: int = pg.USEREVENT + counter.__next__()
-WHEEL_RELEASE_UP: int = pg.USEREVENT + counter.__next__()
\ No newline at end of file
+WHEEL_RELEASE_UP: int = pg.USEREVENT + counter.__next__()
+FOG_REVEAL: int = pg.USEREVENT + counter.__next__()
+FOG_HIDE: int = pg.USEREVENT + counter.__next__()
+SET_WALLS: int = pg.USEREVENT + counter.__next__()
+TOKEN_STATE: int = pg.USEREVENT + counter.__next__()
+CAMERA_STATE: int = pg.USEREVENT + counter.__next__()
+SYNC_STATE: int = pg.USEREVENT + counter.__next__()
+FOG_STATE: int = pg.USEREVENT + counter.__next__()
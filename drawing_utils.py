@@ -1,9 +1,15 @@
 
-from math import pi, cos, sin
+from typing import Tuple
+from math import pi, sin, ceil
 
 import pygame
 from pygame.math import Vector2
 
+from common import GridType
+from hex_grid import HexGridEngine
+
+GRID_TILE_MIN_SIZE = 256
+
 
 def draw_grid_square(surf: pygame.Surface, pos: Vector2, size=50, color=(0,0,0)):
         width, height = surf.get_size()
@@ -18,17 +24,71 @@ def draw_grid_square(surf: pygame.Surface, pos: Vector2, size=50, color=(0,0,0))
             pygame.draw.line(surf, color, (0, i), (width, i))
             i += size
 
-def draw_grid_hex(surf: pygame.Surface, size=50, color=(0,0,0)):
-    a = size
-    b = a * cos(pi / 3)
-    c = a * sin(pi / 3)
-    lines = [
-        [(b, 2 * c), (0, c), (b, 0), (a + b, 0), (2 * b + a, c), (a + b, 2 * c)],
-        [(2 * b + a, c), (2 * b + 2 * a, c)],
-    ]
-
-    for y in range(0, surf.get_height(), int(2 * c)):
-        for x in range(0, surf.get_width(), int(2 * b + 2 * a)):
-            for line in lines:
-                line_offset = [(t[0] + x, t[1] + y) for t in line]
-                pygame.draw.lines(surf, color, False, line_offset)
\ No newline at end of file
+def hex_grid_period(size: float) -> Tuple[float, float]:
+    return 3 * size, 2 * size * sin(pi / 3)
+
+
+def draw_grid_hex(surf: pygame.Surface, pos: Vector2, size=50, color=(0,0,0)):
+    clip = surf.get_clip()
+    for chain in HexGridEngine(size).visible_chains(pos, (clip.left, clip.top, clip.right, clip.bottom)).tolist():
+        pygame.draw.lines(surf, color, False, chain)
+
+
+class GridLayer:
+    '''
+    Grid pre-rendered into a tileable surface.
+    The tile is only redrawn when the grid type, size or color change, every frame is a few tiled blits.
+    The lines cover a few percent of the tile, so it is a run length encoded colorkey surface that blits skip quickly.
+    '''
+
+    def __init__(self, min_tile_size: int = GRID_TILE_MIN_SIZE):
+        self.min_tile_size = min_tile_size
+        self.key = None
+        self.tile: pygame.Surface = None
+        self.tile_period = (0.0, 0.0)
+
+    def render(self, grid_type: GridType, size: float, color) -> None:
+        if grid_type == GridType.HEX:
+            period_x, period_y = hex_grid_period(size)
+        else:
+            period_x, period_y = size, size
+
+        # a whole number of grid periods so neighbouring tiles continue the lattice
+        repeat_x = max(1, ceil(self.min_tile_size / period_x))
+        repeat_y = max(1, ceil(self.min_tile_size / period_y))
+        self.tile_period = (period_x * repeat_x, period_y * repeat_y)
+        key = tuple(255 - channel for channel in tuple(color)[:3])
+        self.tile = pygame.Surface((ceil(self.tile_period[0]), ceil(self.tile_period[1])))
+        self.tile.fill(key)
+        self.tile.set_colorkey(key, pygame.RLEACCEL)
+
+        if grid_type == GridType.HEX:
+            draw_grid_hex(self.tile, Vector2(), size, color)
+        else:
+            width, height = self.tile.get_size()
+            for i in range(repeat_x):
+                pygame.draw.line(self.tile, color, (round(i * size), 0), (round(i * size), height))
+            for i in range(repeat_y):
+                pygame.draw.line(self.tile, color, (0, round(i * size)), (width, round(i * size)))
+
+    def draw(self, surf: pygame.Surface, grid_type: GridType, pos: Vector2, size: float, color) -> None:
+        if grid_type == GridType.NONE or size < 2:
+            return
+
+        key = (grid_type, round(size, 3), tuple(color))
+        if key != self.key:
+            self.render(grid_type, size, color)
+            self.key = key
+
+        tile_w, tile_h = self.tile_period
+        width, height = surf.get_size()
+        x0 = pos[0] % tile_w - tile_w
+        y0 = pos[1] % tile_h - tile_h
+        surf.blits(
+            [
+                (self.tile, (round(x0 + i * tile_w), round(y0 + j * tile_h)))
+                for j in range(ceil((height - y0) / tile_h))
+                for i in range(ceil((width - x0) / tile_w))
+            ],
+            doreturn=False,
+        )
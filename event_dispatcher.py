@@ -0,0 +1,89 @@
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from collections import defaultdict
+
+import pygame
+import custom_events as CustomPyGameEvents
+from models import Message
+
+Handler = Callable[[Message], None]
+
+# events aimed at whatever is under the mouse rather than at everyone who listens
+POINTER_EVENTS = frozenset((
+    pygame.MOUSEMOTION,
+    CustomPyGameEvents.LEFT_MOUSE_CLICK_DOWN,
+    CustomPyGameEvents.LEFT_MOUSE_CLICK_UP,
+    CustomPyGameEvents.MIDDLE_MOUSE_CLICK_DOWN,
+    CustomPyGameEvents.MIDDLE_MOUSE_CLICK_UP,
+    CustomPyGameEvents.RIGHT_MOUSE_CLICK_DOWN,
+    CustomPyGameEvents.RIGHT_MOUSE_CLICK_UP,
+    CustomPyGameEvents.WHEEL_PRESS_DOWN,
+    CustomPyGameEvents.WHEEL_PRESS_UP,
+    CustomPyGameEvents.WHEEL_RELEASE_DOWN,
+    CustomPyGameEvents.WHEEL_RELEASE_UP,
+))
+
+
+class EventDispatcher:
+    '''
+    Routes each message only to the handlers subscribed to its event type.
+    Pointer events go to the capturing owner exclusively, otherwise to the focused owner,
+    falling back to the default owner when the focused one does not handle the type.
+    Other events are delivered to every subscriber of the type.
+    '''
+
+    def __init__(self, default_owner: Optional[Hashable] = None) -> None:
+        self._pointer_handlers: Dict[Hashable, Dict[int, List[Handler]]] = defaultdict(lambda: defaultdict(list))
+        self._broadcast_handlers: Dict[int, List[Tuple[Hashable, Handler]]] = defaultdict(list)
+        self.default_owner: Optional[Hashable] = default_owner
+        self.focus: Optional[Hashable] = None
+        self.captured_by: Optional[Hashable] = None
+
+    def subscribe(self, event_type: int, handler: Handler, owner: Optional[Hashable] = None) -> None:
+        if event_type in POINTER_EVENTS:
+            self._pointer_handlers[owner][event_type].append(handler)
+        else:
+            self._broadcast_handlers[event_type].append((owner, handler))
+
+    def unsubscribe(self, owner: Hashable) -> None:
+        self._pointer_handlers.pop(owner, None)
+        for event_type, handlers in list(self._broadcast_handlers.items()):
+            handlers[:] = [(o, h) for o, h in handlers if o is not owner]
+            if not handlers:
+                del self._broadcast_handlers[event_type]
+        if self.focus is owner:
+            self.focus = None
+        if self.captured_by is owner:
+            self.captured_by = None
+
+    def capture(self, owner: Hashable) -> None:
+        self.captured_by = owner
+
+    def release(self, owner: Hashable) -> None:
+        if self.captured_by is owner:
+            self.captured_by = None
+
+    def _pointer_targets(self, event_type: int) -> List[Handler]:
+        if self.captured_by is not None:
+            return self._handlers_of(self.captured_by, event_type)
+        if self.focus is not None:
+            handlers = self._handlers_of(self.focus, event_type)
+            if handlers:
+                return handlers
+        return self._handlers_of(self.default_owner, event_type)
+
+    def _handlers_of(self, owner: Optional[Hashable], event_type: int) -> List[Handler]:
+        handlers = self._pointer_handlers.get(owner)
+        if handlers is None:
+            return []
+        return handlers.get(event_type, [])
+
+    def dispatch(self, message: Message) -> bool:
+        event_type = message.event.type
+        if event_type in POINTER_EVENTS:
+            handlers = list(self._pointer_targets(event_type))
+        else:
+            handlers = [handler for _, handler in self._broadcast_handlers.get(event_type, ())]
+
+        for handler in handlers:
+            handler(message)
+        return bool(handlers)
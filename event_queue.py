@@ -6,6 +6,15 @@ from models import Message
 from subscriber import Subscriber
 import custom_events as CustomPyGameEvents
 
+# events about the local window, they are handled by each screen and never published
+WINDOW_EVENTS = (
+    pg.VIDEOEXPOSE,
+    pg.VIDEORESIZE,
+    pg.WINDOWEXPOSED,
+    pg.WINDOWSHOWN,
+    pg.WINDOWRESTORED,
+    pg.WINDOWSIZECHANGED,
+)
 
 class EventQueue(ABC):
     @abstractmethod
@@ -21,10 +30,15 @@ class PublisherEventQueue(EventQueue):
         events = self._event_queue.get()
         messages = []
         for event in events:
+            # pygame 2 reports every notch twice, as buttons 4 and 5 and as a MOUSEWHEEL, the buttons are what both screens use
+            if event.type == pg.MOUSEWHEEL:
+                continue
             extra = None
             # This is a hacky way to mask events for both the publisher and the subscriber
             if event.type == pg.KEYDOWN and event.key == pg.K_TAB:
                 event = PyGameEvent(CustomPyGameEvents.MAP_CYCLE_STATE)
+            elif event.type == pg.KEYDOWN and event.key == pg.K_g:
+                event = PyGameEvent(CustomPyGameEvents.CHANGE_GRID_TYPE)
             elif event.type == pg.DROPFILE:
                 extra = {"file": event.file, "pos": pg.mouse.get_pos()}
                 event = PyGameEvent(CustomPyGameEvents.ADD_TOKEN)
@@ -64,9 +78,9 @@ class SubscriberEventQueue(EventQueue):
         self._subscriber: Subscriber = subscriber
 
     def get(self) -> List[Message]:
-        _ = pg.event.get()
-        events = []
-        while event := self._subscriber.get():
-            events.append(event)
+        events = [Message(event=event) for event in pg.event.get() if event.type in WINDOW_EVENTS]
+        # batches arrive in publishing order, each one unpacked in the order it was produced
+        while batch := self._subscriber.get():
+            events.extend(batch.messages)
 
         return events
@@ -1,21 +1,33 @@
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 import multiprocess as mp
 from threading import Thread
 import math
 import time
 import os
+import numpy as np
 import pygame as pg
+from pygame import Vector2
 from pygame.event import Event as PyGameEvent
 from screeninfo import get_monitors
-from event_queue import PublisherEventQueue, SubscriberEventQueue, EventQueue
+from event_queue import PublisherEventQueue, SubscriberEventQueue, EventQueue, WINDOW_EVENTS
 from publisher import Publisher
 from subscriber import Subscriber
 from models import Message
+from session_state import SessionState
 from settings import SettingsManager, GameSettings
 import custom_events as CustomPyGameEvents
 
+from common import GridType
 from canvas import Canvas
 from map_entities import Map, Token, Grid
+from map_cache import MapCache, MAPS_DIR, adjacent_map
+from asset_loader import AssetLoader
+from render_scheduler import RenderScheduler
+from token_layer import TokenLayer
+from token_store import FLAG_SELECTED
+from obscurers import FogOfWar, FogBrush
+from lighting import LightingEngine, load_walls
+from coalescer import EventCoalescer
 from menu_gui import Gui
 
 
@@ -28,10 +40,24 @@ class GameLogic(mp.Process):
         self._stop_event: mp.synchronize.Event = mp.Event()
         self._win: pg.Surface = None
         self._clock: pg.time.Clock = None
+        self._scheduler: RenderScheduler = None
 
         self._settings: GameSettings = None
         self._canvas: Canvas = None
         self._map: Map = None
+        self._grid: Grid = None
+        self._map_cache: MapCache = None
+        self._current_map: str = None
+        self._asset_loader: AssetLoader = None
+        self._token_layer: TokenLayer = None
+        self._tokens: List[Token] = []
+        self._tokens_by_id: Dict[int, Token] = {}
+        self._fogs: Dict[str, FogOfWar] = {}
+        # synced fog of maps not shown yet, loaded once the map is and its size known
+        self._pending_fog: Dict[str, Message] = {}
+        self._fog: FogOfWar = None
+        self._fog_alpha: int = 255
+        self._lighting: LightingEngine = None
 
     def _initialize_window(self, title: str) -> pg.Surface:
         resolution_settings = self._settings.resolution
@@ -49,34 +75,182 @@ class GameLogic(mp.Process):
         settings_manager = SettingsManager()
         self._settings: GameSettings = settings_manager.settings
         self._clock = pg.time.Clock()
+        self._scheduler = RenderScheduler()
         self._canvas = Canvas()
-        self._map = Map(self._canvas)
+        self._canvas.scheduler = self._scheduler
+        graphics_settings = self._settings.graphics
+        self._asset_loader = AssetLoader()
+        self._map_cache = MapCache(graphics_settings.map_cache_budget_mb * 1024 * 1024, self._asset_loader)
+        self._map = Map(
+            self._canvas,
+            tiled=graphics_settings.tiled_map,
+            tile_size=graphics_settings.tile_size,
+            tile_cache_budget=graphics_settings.tile_cache_budget_mb * 1024 * 1024,
+            refine_delay_ms=graphics_settings.zoom_refine_delay_ms,
+            map_cache=self._map_cache,
+        )
+        # first, so it is drawn under everything and hears every zoom to hold its refinement back
+        self._canvas.register_map_entity(self._map)
+        self._grid = Grid(self._canvas)
+        self._grid.set_grid_type(GridType.NONE)
+        self._canvas.register_map_entity(self._grid)
+        self._token_layer = TokenLayer()
+        self._lighting = LightingEngine()
+        self._subscribe_handlers()
         self._win = self._initialize_window(self._name)
         pg.init()
 
 
     def _finalize(self) -> None:
+        self._asset_loader.shutdown()
         pg.quit()
 
+    def _change_map(self, name: str) -> None:
+        if name is None:
+            return
+        self._current_map = name
+        self._map.set_map_image(os.path.join(MAPS_DIR, name))
+        self._lighting.set_walls(load_walls(os.path.join(MAPS_DIR, name)))
+
+        # every map keeps its own fog, revisiting a map shows what was revealed there before
+        self._fog = self._fogs.get(name)
+        if self._fog is None:
+            self._fog = FogOfWar(
+                self._map.surf_initial.get_size(), self._settings.graphics.fog_cell_size, self._fog_alpha
+            )
+            self._fogs[name] = self._fog
+            pending = self._pending_fog.pop(name, None)
+            if pending is not None:
+                self._fog.load(pending.extra)
+
+        # flipping to a neighbouring map should not hit the disk
+        for offset in (1, -1):
+            neighbour = adjacent_map(name, offset)
+            if neighbour is not None and neighbour != name:
+                self._map_cache.prefetch(os.path.join(MAPS_DIR, neighbour))
+
+    def _change_grid_type(self, grid_type: str = None) -> None:
+        if grid_type is None:
+            members = list(GridType)
+            next_index = (members.index(self._grid.grid_type) + 1) % len(members)
+            self._grid.set_grid_type(members[next_index])
+        else:
+            self._grid.set_grid_type(GridType[grid_type])
+
+    def _add_token(
+        self, file: str, pos: Tuple[int, int], token_id: Optional[int] = None, world_pos: Optional[Tuple[float, float]] = None
+    ) -> None:
+        # the DM sends where the token landed in the world, a screen joining later may have its camera elsewhere
+        if token_id in self._tokens_by_id:
+            self._tokens_by_id[token_id].set_transform(world_pos, self._tokens_by_id[token_id].scale)
+            return
+        token = Token(
+            self._canvas,
+            self._canvas.mouse_in_world(pos) if world_pos is None else Vector2(world_pos),
+            file,
+            self._asset_loader,
+            self._settings.graphics.token_vision_radius,
+            token_id,
+        )
+        self._canvas.register_map_entity(token)
+        self._tokens.append(token)
+        if token_id is not None:
+            self._tokens_by_id[token_id] = token
+
+    def _set_token_state(self, message: Message) -> None:
+        token = self._tokens_by_id.get(message.extra["id"])
+        if token is not None:
+            token.set_transform(message.extra["pos"], message.extra["scale"])
+
+    def _sync_state(self, message: Message) -> None:
+        # a screen joining late starts from the server's state instead of the DM's whole history
+        for synced in SessionState.model_validate(message.extra).to_messages():
+            self._handle_message(synced)
+
+    def _load_fog(self, message: Message) -> None:
+        fog = self._fogs.get(message.extra["map"])
+        if fog is None:
+            self._pending_fog[message.extra["map"]] = message
+            return
+        fog.load(message.extra)
+        if fog is self._fog:
+            self._scheduler.invalidate()
+
+    def _apply_fog(self, message: Message) -> None:
+        if self._fog is None:
+            return
+        bounds = self._fog.apply_message(message)
+        if bounds is not None:
+            self._scheduler.invalidate(self._canvas.world_to_screen_rect(bounds))
+
     def _pre_message_handle_hook(self, message: Message) -> None:
         pass
 
     def _post_message_handle_hook(self, message: Message) -> None:
         pass
 
-    def _handle_message(self, message: Message) -> None:
-        event = message.event
-        extra = message.extra
+    def _subscribe_handlers(self) -> None:
+        dispatcher = self._canvas.dispatcher
+        dispatcher.subscribe(pg.QUIT, lambda message: self._stop_event.set(), self)
+        for event_type in WINDOW_EVENTS:
+            dispatcher.subscribe(event_type, lambda message: self._scheduler.invalidate(), self)
 
-        if event.type == pg.QUIT:
-            self._stop_event.set()
-        elif event.type == CustomPyGameEvents.CHANGE_MAP_SPECIFIC:
-            self._map.set_map_image(f'assets/maps/{extra["map"]}')
-        # elif event.type == CustomPyGameEvents.ADD_TOKEN:
-        #     self._map_manager.add_token(extra["file"], extra["pos"])
+        dispatcher.subscribe(
+            CustomPyGameEvents.CHANGE_MAP_SPECIFIC,
+            lambda message: self._change_map(message.extra["map"]),
+            self,
+        )
+        dispatcher.subscribe(
+            CustomPyGameEvents.CHANGE_MAP_NEXT,
+            lambda message: self._change_map(adjacent_map(self._current_map, 1)),
+            self,
+        )
+        dispatcher.subscribe(
+            CustomPyGameEvents.CHANGE_MAP_PREVIOUS,
+            lambda message: self._change_map(adjacent_map(self._current_map, -1)),
+            self,
+        )
+        dispatcher.subscribe(
+            CustomPyGameEvents.CHANGE_GRID_TYPE,
+            lambda message: self._change_grid_type((message.extra or {}).get("grid_type")),
+            self,
+        )
+        dispatcher.subscribe(
+            CustomPyGameEvents.CHANGE_GRID_COLOR,
+            lambda message: self._grid.set_color(message.extra["color"]),
+            self,
+        )
+        dispatcher.subscribe(
+            CustomPyGameEvents.CHANGE_GRID_SIZE,
+            lambda message: self._grid.set_size(message.extra["size"]),
+            self,
+        )
+        dispatcher.subscribe(
+            CustomPyGameEvents.SET_WALLS,
+            lambda message: self._lighting.set_walls(message.extra["walls"]),
+            self,
+        )
+        for event_type in (CustomPyGameEvents.FOG_REVEAL, CustomPyGameEvents.FOG_HIDE):
+            dispatcher.subscribe(event_type, self._apply_fog, self)
+        dispatcher.subscribe(CustomPyGameEvents.FOG_STATE, self._load_fog, self)
+        dispatcher.subscribe(
+            CustomPyGameEvents.ADD_TOKEN,
+            lambda message: self._add_token(
+                message.extra["file"], message.extra["pos"], message.extra.get("id"), message.extra.get("world_pos")
+            ),
+            self,
+        )
+        dispatcher.subscribe(CustomPyGameEvents.TOKEN_STATE, self._set_token_state, self)
+        dispatcher.subscribe(CustomPyGameEvents.SYNC_STATE, self._sync_state, self)
+        dispatcher.subscribe(
+            CustomPyGameEvents.CAMERA_STATE,
+            lambda message: self._canvas.set_camera(message.extra["cam"], message.extra["scale"]),
+            self,
+        )
 
-        self._map.handle_event(message)
-        self._canvas.handle_event(message)
+    def _handle_message(self, message: Message) -> None:
+        # the canvas routes pointer events to the hovered or capturing entity, the rest by type
+        self._canvas.dispatch(message)
 
     def _handle_messages(self, messages: list[Message]) -> None:
         for message in messages:
@@ -84,19 +258,58 @@ class GameLogic(mp.Process):
             self._handle_message(message)
             self._post_message_handle_hook(message)
 
+    def step(self) -> None:
+        self._map.step()
+        for token in self._tokens:
+            token.step()
+            if token.vision_radius > 0:
+                self._lighting.set_source(token, token.pos, token.vision_radius)
+        # only tokens that moved get their visibility recomputed
+        if self._lighting.update():
+            self._scheduler.invalidate()
+        # the fog patched during a stroke is smoothscaled whole once the stroke pauses
+        if self._fog is not None and self._fog.refine_due:
+            self._scheduler.invalidate()
+
     def draw(self) -> None:
         self._map.draw(self._win)
+        self._grid.draw(self._win)
+        self._draw_tokens()
+        self._lighting.draw(self._win, self._canvas.cam, self._canvas.scale)
+        if self._fog is not None:
+            self._fog.draw(self._win, self._canvas.cam, self._canvas.scale)
+
+    def _draw_tokens(self) -> None:
+        store = self._canvas.tokens
+        slots = store.slots()
+        centers = store.world_to_screen(self._canvas.cam, self._canvas.scale, slots).tolist()
+        selected = (store.flags[slots] & FLAG_SELECTED) != 0
+
+        sprites, rings = [], []
+        for slot, center, is_selected in zip(slots.tolist(), centers, selected.tolist()):
+            surf = store.items[slot].surf
+            sprites.append((surf, center))
+            if is_selected:
+                rings.append((center, surf.get_width() // 2))
+        self._token_layer.draw(self._win, sprites, rings)
 
     def run(self) -> None:
         self._initialize()
         while not self._stop_event.is_set():
             messages = self._message_queue.get()
             self._handle_messages(messages)
+            self.step()
+
+            # nothing changed since the last frame, keep pumping events without redrawing
+            if self._scheduler.needs_redraw:
+                rects = self._scheduler.flush(self._win.get_rect())
+                for rect in rects:
+                    self._win.set_clip(rect)
+                    self._win.fill((0,0,0))
+                    self.draw()
+                self._win.set_clip(None)
+                pg.display.update(rects)
 
-            self._win.fill((0,0,0))
-            self.draw()
-
-            pg.display.update()
             self._clock.tick(60)
 
         self._finalize()
@@ -106,30 +319,115 @@ class PublisherGameLogic(GameLogic):
     def __init__(self) -> None:
         super().__init__("DM Screen", PublisherEventQueue())
         self._publisher: Publisher = Publisher()
+        self._fog_brush: FogBrush = None
+        self._coalescer: EventCoalescer = EventCoalescer()
+        self._next_token_id: int = 0
+        self._published_camera: Tuple[float, float, float] = None
+        # x, y and scale of every token slot as last published, NaN for slots never published
+        self._published_tokens: np.ndarray = np.empty((0, 3))
         self._publisher_thread: Thread = Thread(
             target=self._publisher.start, daemon=True
         )
 
     def _initialize(self) -> None:
         super()._initialize()
+        self._fog_alpha = self._settings.graphics.fog_dm_alpha
+        self._lighting.alpha = self._fog_alpha
+        self._fog_brush = FogBrush(self._canvas)
         self._publisher_thread.start()
 
         # DEMO
         event = PyGameEvent(CustomPyGameEvents.CHANGE_MAP_SPECIFIC)
         extra = {"map": "image_31.jfif"}
         self._publisher.publish(event, extra)
-        self._map.set_map_image(f'assets/maps/{extra["map"]}')
+        self._change_map(extra["map"])
+        self._publisher.flush()
 
     def _finalize(self) -> None:
         self._publisher.stop()
         self._publisher_thread.join()
         super()._finalize()
 
+    def _change_map(self, name: str) -> None:
+        super()._change_map(name)
+        # the walls come from the DM's disk, the screens light the map with the same ones
+        if name is not None:
+            self._publisher.publish(PyGameEvent(CustomPyGameEvents.SET_WALLS), {"walls": self._lighting.walls.tolist()})
+
+    def _handle_messages(self, messages: list[Message]) -> None:
+        # both screens see the coalesced stream, the DM handles exactly what it publishes
+        messages = self._coalescer.coalesce(messages)
+        # brush strokes become fog messages right behind the input that produced them
+        for message in messages:
+            message = self._resolve(message)
+            if message is not None:
+                super()._handle_messages([message, *self._fog_brush.feed(message)])
+        self._publish_state_changes()
+        # everything this tick published goes out as one frame
+        self._publisher.flush()
+
+    def _resolve(self, message: Message) -> Optional[Message]:
+        '''
+        Rewrites changes relative to the DM's current state into absolute ones before they are handled and published,
+        so the broker only has to keep the latest of each and a late screen ends up where the DM is.
+        '''
+        event_type = message.event.type
+        extra = message.extra or {}
+        if event_type in (CustomPyGameEvents.CHANGE_MAP_NEXT, CustomPyGameEvents.CHANGE_MAP_PREVIOUS):
+            offset = 1 if event_type == CustomPyGameEvents.CHANGE_MAP_NEXT else -1
+            name = adjacent_map(self._current_map, offset)
+            if name is None:
+                return None
+            return Message(event=PyGameEvent(CustomPyGameEvents.CHANGE_MAP_SPECIFIC), extra={"map": name})
+
+        if event_type == CustomPyGameEvents.CHANGE_GRID_TYPE and "grid_type" not in extra:
+            members = list(GridType)
+            grid_type = members[(members.index(self._grid.grid_type) + 1) % len(members)]
+            return Message(event=message.event, extra={"grid_type": grid_type.name})
+
+        if event_type == CustomPyGameEvents.ADD_TOKEN and "id" not in extra:
+            world_pos = self._canvas.mouse_in_world(extra["pos"])
+            self._next_token_id += 1
+            return Message(event=message.event, extra={**extra, "id": self._next_token_id, "world_pos": [world_pos.x, world_pos.y]})
+
+        return message
+
+    def _publish_state_changes(self) -> None:
+        ''' publishes where the camera and tokens ended up once no drag is in progress '''
+        if self._canvas.dispatcher.captured_by is not None:
+            return
+
+        camera = (self._canvas.cam.x, self._canvas.cam.y, self._canvas.scale)
+        if camera != self._published_camera:
+            self._publisher.publish(
+                PyGameEvent(CustomPyGameEvents.CAMERA_STATE), {"cam": list(camera[:2]), "scale": camera[2]}
+            )
+            self._published_camera = camera
+
+        store = self._canvas.tokens
+        if len(self._published_tokens) < store.capacity:
+            grown = np.full((store.capacity, 3), np.nan)
+            grown[:len(self._published_tokens)] = self._published_tokens
+            self._published_tokens = grown
+
+        slots = store.slots()
+        state = np.column_stack((store.pos[slots], store.scale[slots]))
+        changed = np.any(state != self._published_tokens[slots], axis=1)
+        for slot, (x, y, scale) in zip(slots[changed].tolist(), state[changed].tolist()):
+            token_id = store.items[slot].token_id
+            if token_id is not None:
+                self._publisher.publish(
+                    PyGameEvent(CustomPyGameEvents.TOKEN_STATE), {"id": token_id, "pos": [x, y], "scale": scale}
+                )
+        self._published_tokens[slots] = state
+
     def _pre_message_handle_hook(self, message):
         # if message.event.type == CustomPyGameEvents.CIRCLE_INTERACT:
         #     self._publisher.publish(message.event)
-        self._publisher.publish(message.event, message.extra)
+        if message.event.type not in WINDOW_EVENTS:
+            self._publisher.publish(message.event, message.extra)
         if message.event.type == pg.QUIT:
+            self._publisher.flush()
             time.sleep(0.1)
 
     def draw(self) -> None:
@@ -0,0 +1,66 @@
+from typing import Tuple
+from math import ceil, floor, sqrt
+
+import numpy as np
+
+Viewport = Tuple[float, float, float, float]
+
+# vertex directions of a flat-top hex, y grows downwards
+_ANGLES = np.radians(np.arange(6) * 60.0)
+HEX_VERTICES = np.stack([np.cos(_ANGLES), np.sin(_ANGLES)], axis=1)
+
+# every cell owns its lower-left, upper-left and top edges, the other three belong to its neighbours;
+# together they form the open chain through vertices 2, 3, 4 and 5
+OWNED_CHAIN = np.array([2, 3, 4, 5])
+
+
+class HexGridEngine:
+    '''
+    Flat-top hex lattice computed in bulk with NumPy.
+    The cell at (col, row) is centered at origin + (size + 1.5 * size * col, h + 2h * row + h * (col % 2))
+    with h = size * sqrt(3) / 2, so neighbouring cells share their edges and the cells tile as a honeycomb.
+    The lattice repeats every (3 * size, 2h).
+    '''
+
+    def __init__(self, size: float) -> None:
+        self.size: float = size
+        self.half_height: float = size * sqrt(3) / 2
+
+    def visible_cells(self, origin: Tuple[float, float], viewport: Viewport) -> np.ndarray:
+        ''' (N, 2) array of the cols and rows whose hex can intersect the viewport '''
+        a, h = self.size, self.half_height
+        x0, y0, x1, y1 = viewport
+        ox, oy = origin
+
+        col0 = floor((x0 - ox - 2 * a) / (1.5 * a))
+        col1 = ceil((x1 - ox) / (1.5 * a))
+        row0 = floor((y0 - oy - 3 * h) / (2 * h))
+        row1 = ceil((y1 - oy) / (2 * h))
+
+        cols, rows = np.meshgrid(np.arange(col0, col1 + 1), np.arange(row0, row1 + 1))
+        return np.stack([cols.ravel(), rows.ravel()], axis=1)
+
+    def centers(self, origin: Tuple[float, float], cells: np.ndarray) -> np.ndarray:
+        a, h = self.size, self.half_height
+        cols, rows = cells[:, 0], cells[:, 1]
+        x = origin[0] + a + 1.5 * a * cols
+        y = origin[1] + h + 2 * h * rows + h * (cols % 2)
+        return np.stack([x, y], axis=1)
+
+    def _vertices(self, origin: Tuple[float, float], viewport: Viewport) -> np.ndarray:
+        centers = self.centers(origin, self.visible_cells(origin, viewport))
+        return centers[:, None, :] + self.size * HEX_VERTICES[None, :, :]
+
+    @staticmethod
+    def _cull(shapes: np.ndarray, viewport: Viewport) -> np.ndarray:
+        x0, y0, x1, y1 = viewport
+        low, high = shapes.min(axis=1), shapes.max(axis=1)
+        inside = (low[:, 0] <= x1) & (high[:, 0] >= x0) & (low[:, 1] <= y1) & (high[:, 1] >= y0)
+        return shapes[inside]
+
+    def visible_chains(self, origin: Tuple[float, float], viewport: Viewport) -> np.ndarray:
+        ''' (N, 4, 2) array of the owned edge chain of every cell intersecting the viewport '''
+        return self._cull(self._vertices(origin, viewport)[:, OWNED_CHAIN], viewport)
+
+    def period(self) -> Tuple[float, float]:
+        return 3 * self.size, 2 * self.half_height
@@ -0,0 +1,79 @@
+from typing import Dict, List
+from threading import Lock
+
+import pygame
+from pydantic import BaseModel, Field
+
+from surface_cache import surface_bytes
+
+
+class AssetInfo(BaseModel):
+    path: str = Field(description="Path the asset was loaded from")
+    width: int = Field(description="Width of the surface in pixels")
+    height: int = Field(description="Height of the surface in pixels")
+    bytes: int = Field(description="Pixel memory held by the surface")
+    has_alpha: bool = Field(description="Whether the surface keeps a per-pixel alpha channel")
+
+
+class AssetRegistry:
+    def __init__(self) -> None:
+        self._assets: Dict[str, AssetInfo] = {}
+        self._lock: Lock = Lock()
+
+    def record(self, path: str, surf: pygame.Surface) -> AssetInfo:
+        info = AssetInfo(
+            path=path,
+            width=surf.get_width(),
+            height=surf.get_height(),
+            bytes=surface_bytes(surf),
+            has_alpha=bool(surf.get_flags() & pygame.SRCALPHA),
+        )
+        with self._lock:
+            self._assets[path] = info
+        return info
+
+    def get(self, path: str) -> AssetInfo:
+        with self._lock:
+            return self._assets.get(path)
+
+    def assets(self) -> List[AssetInfo]:
+        with self._lock:
+            return list(self._assets.values())
+
+    def total_bytes(self) -> int:
+        return sum(info.bytes for info in self.assets())
+
+    def report(self) -> str:
+        assets = sorted(self.assets(), key=lambda info: info.bytes, reverse=True)
+        lines = [f"{len(assets)} assets, {self.total_bytes() / 2 ** 20:.1f} MB"]
+        lines += [
+            f"  {info.bytes / 2 ** 20:8.1f} MB  {info.width}x{info.height}{' alpha' if info.has_alpha else ''}  {info.path}"
+            for info in assets
+        ]
+        return "\n".join(lines)
+
+
+registry = AssetRegistry()
+
+
+def uses_alpha(surf: pygame.Surface) -> bool:
+    if not surf.get_flags() & pygame.SRCALPHA:
+        return False
+    # images saved with an alpha channel are often fully opaque
+    opaque = pygame.mask.from_surface(surf, 254).count()
+    return opaque != surf.get_width() * surf.get_height()
+
+
+def normalize(surf: pygame.Surface) -> pygame.Surface:
+    ''' converts to the display pixel format so blits skip per-pixel conversion '''
+    if pygame.display.get_surface() is None:
+        return surf
+    if uses_alpha(surf):
+        return surf.convert_alpha()
+    return surf.convert()
+
+
+def load_image(path: str) -> pygame.Surface:
+    surf = normalize(pygame.image.load(path))
+    registry.record(path, surf)
+    return surf
@@ -0,0 +1,160 @@
+from typing import Dict, Hashable, Optional, Sequence, Set, Tuple
+import json
+import os
+
+import numpy as np
+import pygame
+from pygame import Vector2
+
+DEFAULT_RAY_COUNT = 180
+DARKNESS_COLOR = (0, 0, 0)
+# rays cast just beside every wall end point so light slips past corners
+CORNER_EPSILON = 1e-4
+
+Point = Tuple[float, float]
+
+
+def load_walls(map_path: str) -> np.ndarray:
+    ''' wall segments stored next to a map as <map>.walls.json, a list of [x0, y0, x1, y1] '''
+    walls_path = f"{map_path}.walls.json"
+    if not os.path.exists(walls_path):
+        return np.zeros((0, 4))
+    with open(walls_path, "r") as f:
+        return np.asarray(json.load(f), dtype=float).reshape(-1, 4)
+
+
+def changed_walls(old: np.ndarray, new: np.ndarray) -> np.ndarray:
+    ''' walls in one set but not the other '''
+    return np.asarray(sorted(set(map(tuple, old.tolist())) ^ set(map(tuple, new.tolist()))), dtype=float).reshape(-1, 4)
+
+
+def in_reach(origins: np.ndarray, radii: np.ndarray, walls: np.ndarray) -> np.ndarray:
+    ''' which of the (S, 2) origins have one of the walls within radius, by the same bounds test visibility_polygon culls with '''
+    low = np.minimum(walls[:, :2], walls[:, 2:])
+    high = np.maximum(walls[:, :2], walls[:, 2:])
+    ox, oy, r = origins[:, :1], origins[:, 1:], radii[:, None]
+    near = (low[:, 0] <= ox + r) & (high[:, 0] >= ox - r) & (low[:, 1] <= oy + r) & (high[:, 1] >= oy - r)
+    return near.any(axis=1)
+
+
+def visibility_polygon(origin: Point, radius: float, walls: np.ndarray, rays: int = DEFAULT_RAY_COUNT) -> np.ndarray:
+    '''
+    (N, 2) polygon of what is visible from origin up to radius, in world coordinates.
+    Rays go out at evenly spaced angles plus just beside the end points of walls within reach,
+    and every ray is intersected with every nearby wall at once.
+    '''
+    ox, oy = origin
+    if len(walls):
+        low = np.minimum(walls[:, :2], walls[:, 2:])
+        high = np.maximum(walls[:, :2], walls[:, 2:])
+        near = (low[:, 0] <= ox + radius) & (high[:, 0] >= ox - radius) & (low[:, 1] <= oy + radius) & (high[:, 1] >= oy - radius)
+        walls = walls[near]
+
+    angles = np.linspace(-np.pi, np.pi, rays, endpoint=False)
+    if len(walls):
+        ends = walls.reshape(-1, 2)
+        corner = np.arctan2(ends[:, 1] - oy, ends[:, 0] - ox)
+        angles = np.concatenate([angles, corner - CORNER_EPSILON, corner, corner + CORNER_EPSILON])
+    angles = np.sort(angles)
+    directions = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+    reach = np.full(len(angles), float(radius))
+    if len(walls):
+        # o + t * d meets a + u * e where e = b - a
+        ax, ay = walls[:, 0] - ox, walls[:, 1] - oy
+        ex, ey = walls[:, 2] - walls[:, 0], walls[:, 3] - walls[:, 1]
+        dx, dy = directions[:, :1], directions[:, 1:]
+        denom = dx * ey - dy * ex
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (ax * ey - ay * ex) / denom
+            u = (ax * dy - ay * dx) / denom
+        hits = (denom != 0) & (t >= 0) & (u >= 0) & (u <= 1)
+        reach = np.minimum(reach, np.where(hits, t, np.inf).min(axis=1))
+
+    return np.asarray(origin, dtype=float) + directions * reach[:, None]
+
+
+class LightingEngine:
+    '''
+    Darkness with holes cut by the visibility polygon of every light source.
+    Sources are recomputed only when they move or a wall within their reach changes, and the darkness
+    overlay is rebuilt only when a polygon or the camera changed.
+    '''
+
+    def __init__(self, alpha: int = 255, rays: int = DEFAULT_RAY_COUNT) -> None:
+        self.alpha: int = alpha
+        self.rays: int = rays
+        self.walls: np.ndarray = np.zeros((0, 4))
+
+        self._sources: Dict[Hashable, Tuple[Point, float]] = {}
+        self._polygons: Dict[Hashable, np.ndarray] = {}
+        self._dirty: Set[Hashable] = set()
+        self._version: int = 0
+
+        self._overlay: pygame.Surface = None
+        self._overlay_key: Tuple = None
+
+    @property
+    def active(self) -> bool:
+        ''' without light sources the scene is drawn fully lit '''
+        return bool(self._sources)
+
+    def set_walls(self, walls: Sequence[Sequence[float]]) -> None:
+        walls = np.asarray(walls, dtype=float).reshape(-1, 4)
+        changed = changed_walls(self.walls, walls)
+        self.walls = walls
+        if not len(changed) or not self._sources:
+            return
+        # a wall out of a source's reach never enters its polygon, adding or removing it changes nothing there
+        keys = list(self._sources)
+        origins = np.array([self._sources[key][0] for key in keys])
+        radii = np.array([self._sources[key][1] for key in keys])
+        self._dirty.update(key for key, hit in zip(keys, in_reach(origins, radii, changed).tolist()) if hit)
+
+    def set_source(self, key: Hashable, pos: Point, radius: float) -> None:
+        source = ((float(pos[0]), float(pos[1])), float(radius))
+        if self._sources.get(key) != source:
+            self._sources[key] = source
+            self._dirty.add(key)
+
+    def remove_source(self, key: Hashable) -> None:
+        if self._sources.pop(key, None) is not None:
+            self._polygons.pop(key, None)
+            self._dirty.discard(key)
+            self._version += 1
+
+    def clear(self) -> None:
+        self._sources.clear()
+        self._polygons.clear()
+        self._dirty.clear()
+        self._version += 1
+
+    def polygon(self, key: Hashable) -> Optional[np.ndarray]:
+        return self._polygons.get(key)
+
+    def update(self) -> bool:
+        ''' recomputes the sources that changed, returns True when anything did '''
+        if not self._dirty:
+            return False
+        for key in self._dirty:
+            origin, radius = self._sources[key]
+            self._polygons[key] = visibility_polygon(origin, radius, self.walls, self.rays)
+        self._dirty.clear()
+        self._version += 1
+        return True
+
+    def draw(self, win: pygame.Surface, cam: Vector2, scale: float) -> None:
+        if not self.active:
+            return
+
+        key = (self._version, cam[0], cam[1], scale, win.get_size())
+        if key != self._overlay_key:
+            if self._overlay is None or self._overlay.get_size() != win.get_size():
+                self._overlay = pygame.Surface(win.get_size(), pygame.SRCALPHA)
+            self._overlay.fill((*DARKNESS_COLOR, self.alpha))
+            offset = np.array([cam[0], cam[1]])
+            for polygon in self._polygons.values():
+                # drawing replaces pixels instead of blending, so this punches a transparent hole
+                pygame.draw.polygon(self._overlay, (*DARKNESS_COLOR, 0), (offset + polygon * scale).tolist())
+            self._overlay_key = key
+        win.blit(self._overlay, (0, 0))
@@ -0,0 +1,86 @@
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future
+from threading import Lock
+import os
+
+from surface_cache import SurfaceCache
+from zoom_pyramid import ZoomPyramid
+from asset_loader import AssetLoader
+from image_ingest import load_image
+
+MAPS_DIR = "assets/maps"
+MAP_EXTENSIONS = (".png", ".jpg", ".jpeg", ".jfif", ".bmp", ".webp")
+DEFAULT_MAP_CACHE_BUDGET = 1024 * 1024 * 1024
+
+MapKey = Tuple[str, int]
+
+
+def list_maps(maps_dir: str = MAPS_DIR) -> List[str]:
+    try:
+        files = os.listdir(maps_dir)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in files if name.lower().endswith(MAP_EXTENSIONS))
+
+
+def adjacent_map(current: Optional[str], offset: int, maps_dir: str = MAPS_DIR) -> Optional[str]:
+    maps = list_maps(maps_dir)
+    if not maps:
+        return None
+    if current not in maps:
+        return maps[0] if offset >= 0 else maps[-1]
+    return maps[(maps.index(current) + offset) % len(maps)]
+
+
+class MapCache(SurfaceCache):
+    '''
+    Process-local cache of decoded maps (with their zoom pyramids) keyed by path and mtime.
+    Neighbouring maps can be prefetched on a background thread so flipping maps is served from memory.
+    '''
+
+    def __init__(self, budget: int = DEFAULT_MAP_CACHE_BUDGET, loader: Optional[AssetLoader] = None) -> None:
+        super().__init__(budget)
+        self._loader: AssetLoader = loader if loader is not None else AssetLoader(workers=1)
+        self._in_flight: Dict[MapKey, Future] = {}
+        self._in_flight_lock: Lock = Lock()
+
+    def sizeof(self, value: ZoomPyramid) -> int:
+        return value.bytes
+
+    @staticmethod
+    def key(path: str) -> MapKey:
+        return os.path.abspath(path), os.stat(path).st_mtime_ns
+
+    def _decode(self, key: MapKey) -> ZoomPyramid:
+        pyramid = ZoomPyramid(load_image(key[0]))
+        self.put(key, pyramid)
+        with self._in_flight_lock:
+            self._in_flight.pop(key, None)
+        return pyramid
+
+    def _submit(self, key: MapKey) -> Future:
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._loader.submit(self._decode, key)
+                self._in_flight[key] = future
+            return future
+
+    def load(self, path: str) -> ZoomPyramid:
+        key = self.key(path)
+        pyramid = self.get(key)
+        if pyramid is not None:
+            return pyramid
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+        if future is not None:
+            return future.result()
+        return self._decode(key)
+
+    def prefetch(self, path: str) -> None:
+        try:
+            key = self.key(path)
+        except OSError:
+            return
+        if key not in self:
+            self._submit(key)
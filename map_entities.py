@@ -1,43 +1,111 @@
-from typing import List
+from typing import Hashable, List, Optional
+from concurrent.futures import Future
 import os
 from random import choice
 
 import pygame
 from pygame.math import Vector2
 
-from common import MapInteractiveState, GridType
-from drawing_utils import draw_grid_hex, draw_grid_square
+from common import MapInteractiveState, GridType, GridColors
+from drawing_utils import GridLayer
 from canvas import Canvas, MapEntity
+from zoom_pyramid import ZoomPyramid
+from tiled_map import TiledMap, TileCache, DEFAULT_TILE_SIZE, DEFAULT_TILE_CACHE_BUDGET
+from progressive_scaler import ProgressiveScaler, zoom_is_idle, REFINE_DELAY_MS
+from map_cache import MapCache
+from asset_loader import AssetLoader
+from image_ingest import load_image
+from token_store import TokenHandle, FLAG_SELECTED
 
 from menu_gui import Gui, ImageToggle, StackPanel, HORIZONTAL
 
 
 class Map(MapEntity):
-    def __init__(self, canvas: Canvas):
+    def __init__(
+        self,
+        canvas: Canvas,
+        tiled: bool = False,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        tile_cache_budget: int = DEFAULT_TILE_CACHE_BUDGET,
+        refine_delay_ms: int = REFINE_DELAY_MS,
+        map_cache: MapCache = None,
+    ):
         super().__init__(canvas)
         self.surf_initial: pygame.Surface = None
         self.surf: pygame.Surface = None
+        self.pyramid: ZoomPyramid = None
+        self.scaler: ProgressiveScaler = None
+
+        self.tiled = tiled
+        self.tile_size = tile_size
+        self.tile_cache_budget = tile_cache_budget
+        self.tiles: TiledMap = None
+
+        self.refine_delay_ms = refine_delay_ms
+        self.last_zoom_ms = 0
+        self.refine_future: Future = None
+        self.win_size = (0, 0)
+        self.map_cache = map_cache
 
     def set_map_image(self, path: str):
-        self.surf_initial = pygame.image.load(path)
-        self.surf = self.surf_initial
+        if self.map_cache is not None:
+            self.pyramid = self.map_cache.load(path)
+        else:
+            self.pyramid = ZoomPyramid(load_image(path))
+        self.surf_initial = self.pyramid.levels[0]
+        # a refinement still running for the previous map writes into that map's own cache, never this one's
+        self.refine_future = None
+        if self.tiled:
+            self.tiles = TiledMap(self.pyramid, self.tile_size, TileCache(self.tile_cache_budget))
+        else:
+            self.scaler = ProgressiveScaler(
+                self.surf_initial, self.canvas.scale, self.pyramid.get, self.refine_delay_ms
+            )
+            self.surf = self.scaler.surface
+        self.invalidate()
 
     def update_canvas_scale(self, canvas) -> None:
         super().update_canvas_scale(canvas)
-        self.surf = pygame.transform.smoothscale_by(self.surf_initial, canvas.scale)
+        self.last_zoom_ms = pygame.time.get_ticks()
+        if self.scaler is not None:
+            self.surf = self.scaler.request(canvas.scale)
 
-    def draw(self, win: pygame.Surface) -> None:
-        if self.surf is None:
+    def is_zooming(self) -> bool:
+        return not zoom_is_idle(self.last_zoom_ms, self.refine_delay_ms)
+
+    def step(self) -> None:
+        super().step()
+        if self.scaler is not None and self.scaler.step():
+            self.surf = self.scaler.surface
+            self.invalidate()
+
+        if self.tiles is None:
             return
-        win.blit(self.surf, self.canvas.cam)
+        if self.refine_future is not None:
+            if not self.refine_future.done():
+                return
+            self.refine_future = None
+            self.invalidate()
+        if not self.is_zooming():
+            self.refine_future = self.tiles.refine(self.win_size, self.canvas.cam, self.canvas.scale)
+
+    def draw(self, win: pygame.Surface) -> None:
+        self.win_size = win.get_size()
+        if self.tiles is not None:
+            fast = self.is_zooming() or self.refine_future is not None
+            self.tiles.draw(win, self.canvas.cam, self.canvas.scale, fast)
+        elif self.surf is not None:
+            win.blit(self.surf, self.canvas.cam)
 
 
 class Grid(MapEntity):
     def __init__(self, canvas: Canvas):
         super().__init__(canvas)
         self.grid_type = GridType.SQUARE
+        self.color = GridColors.BLACK.value
         self.initial_size = 50.0
         self.size = self.initial_size
+        self.layer = GridLayer()
 
         self.selectable = True
         self.draggable = True
@@ -51,43 +119,159 @@ class Grid(MapEntity):
         super().update_scale()
         self.size = self.initial_size * self.canvas.scale * self.scale
 
+    def set_grid_type(self, grid_type: GridType) -> None:
+        self.grid_type = grid_type
+        self.invalidate()
+
+    def set_color(self, color) -> None:
+        self.color = tuple(color)
+        self.invalidate()
+
+    def set_size(self, size: float) -> None:
+        self.initial_size = size
+        self.size = self.initial_size * self.canvas.scale * self.scale
+        self.invalidate()
+
     def check_if_selected(self, mouse_pos: Vector2) -> None:
         self.selected = True
 
     def draw(self, win: pygame.Surface) -> None:
         pos = self.canvas.cam + self.pos * self.canvas.scale
-        if self.grid_type == GridType.SQUARE:
-            draw_grid_square(win, pos, self.size)
+        self.layer.draw(win, self.grid_type, pos, self.size, self.color)
+
+
+PLACEHOLDER_SIZE = 100
+PLACEHOLDER_COLOR = (128, 128, 128, 160)
+PLACEHOLDER_ID = "__token_placeholder__"
+
+_placeholder: pygame.Surface = None
+
+
+def token_placeholder() -> pygame.Surface:
+    global _placeholder
+    if _placeholder is None:
+        _placeholder = pygame.Surface((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), pygame.SRCALPHA)
+        radius = PLACEHOLDER_SIZE // 2
+        pygame.draw.circle(_placeholder, PLACEHOLDER_COLOR, (radius, radius), radius)
+    return _placeholder
 
 
 class Token(MapEntity):
-    def __init__(self, canvas: Canvas, pos: Vector2, image_path: str):
+    def __init__(
+        self,
+        canvas: Canvas,
+        pos: Vector2,
+        image_path: str,
+        asset_loader: AssetLoader = None,
+        vision_radius: float = 0.0,
+        token_id: Optional[int] = None,
+    ):
+        # position, scale and selection live in the canvas token store, this object is a view of its slot
+        self.handle: TokenHandle = canvas.tokens.handle(canvas.tokens.add(pos, item=self))
         super().__init__(canvas)
         self.pos = pos
+        self.image_path = image_path
+        # assigned by the DM so both screens can refer to the same token
+        self.token_id = token_id
 
-        self.surf_initial: pygame.Surface = pygame.image.load(image_path)
-        self.surf: pygame.Surface = self.surf_initial
+        self.surf_initial: pygame.Surface = None
+        self.surf: pygame.Surface = None
+        self.scaler: ProgressiveScaler = None
+
+        # with a loader the image is decoded off the render thread and swapped in by step()
+        self.image_future: Future = None
+        if asset_loader is None:
+            self.set_image(load_image(image_path), image_path)
+        else:
+            self.image_future = asset_loader.load(image_path)
+            self.set_image(token_placeholder(), PLACEHOLDER_ID)
 
         self.selectable = True
         self.scaleable = True
         self.draggable = True
+        # world space reach of the token's sight, 0 makes it no light source
+        self.vision_radius = vision_radius
+
+    @property
+    def pos(self) -> Vector2:
+        return self.handle.pos
+
+    @pos.setter
+    def pos(self, value: Vector2) -> None:
+        self.handle.pos = value
+
+    @property
+    def scale(self) -> float:
+        return self.handle.scale
+
+    @scale.setter
+    def scale(self, value: float) -> None:
+        self.handle.scale = value
+
+    @property
+    def selected(self) -> bool:
+        return self.handle.has_flag(FLAG_SELECTED)
+
+    @selected.setter
+    def selected(self, value: bool) -> None:
+        self.handle.set_flag(FLAG_SELECTED, value)
+
+    def set_image(self, surf: pygame.Surface, image_id: Hashable) -> None:
+        ''' image_id names the source image, tokens sharing it share their scaled sprites '''
+        if self.surf is not None:
+            self.invalidate()
+        self.surf_initial = surf
+        self.handle.radius = surf.get_width() / 2
+        self.scaler = ProgressiveScaler(self.surf_initial, self.scale * self.canvas.scale, cache_key=image_id)
+        self.surf = self.scaler.surface
+        self.invalidate()
+        self.update_bounds()
 
     def update_canvas_scale(self, canvas) -> None:
         super().update_canvas_scale(canvas)
-        self.surf = pygame.transform.smoothscale_by(self.surf_initial, self.scale * canvas.scale)
+        self.surf = self.scaler.request(self.scale * canvas.scale)
 
     def update_scale(self) -> None:
         super().update_scale()
-        self.surf = pygame.transform.smoothscale_by(self.surf_initial, self.scale * canvas.scale)
+        self.surf = self.scaler.request(self.scale * self.canvas.scale)
+
+    def step(self) -> None:
+        super().step()
+        if self.image_future is not None and self.image_future.done():
+            future, self.image_future = self.image_future, None
+            try:
+                self.set_image(future.result(), self.image_path)
+            except Exception as e:
+                print(f"Error while loading token image: {self.image_path}\n{e}")
+
+        if self.scaler.step():
+            self.surf = self.scaler.surface
+            self.invalidate()
+
+    def screen_pos(self) -> Vector2:
+        return self.canvas.cam + self.pos * self.canvas.scale
+
+    def screen_rect(self) -> pygame.Rect:
+        rect = self.surf.get_rect()
+        rect.center = self.screen_pos()
+        return rect
+
+    def world_bounds(self):
+        half_width = self.surf_initial.get_width() * self.scale / 2
+        half_height = self.surf_initial.get_height() * self.scale / 2
+        return (
+            self.pos[0] - half_width, self.pos[1] - half_height,
+            self.pos[0] + half_width, self.pos[1] + half_height,
+        )
+
+    def hit_test(self, mouse_pos: Vector2) -> bool:
+        return self.screen_pos().distance_to(mouse_pos) < self.surf.get_size()[0] / 2
 
     def check_if_selected(self, mouse_pos: Vector2) -> None:
-        self.selected = False
-        pos = self.canvas.cam + self.pos * self.canvas.scale
-        if pos.distance_to(mouse_pos) < self.surf.get_size()[0] / 2:
-            self.selected = True
+        self.selected = self.hit_test(mouse_pos)
 
     def draw(self, win: pygame.Surface) -> None:
-        pos = self.canvas.cam + self.pos * self.canvas.scale
+        pos = self.screen_pos()
         win.blit(self.surf, pos - Vector2(self.surf.get_size()) / 2)
         if self.selected:
             pygame.draw.circle(win, (255, 255, 255), pos, self.surf.get_size()[0] // 2, 1)
@@ -185,6 +369,9 @@ if __name__ == "__main__":
             gui.handle_pygame_event(event)
 
         # step
+        map.step()
+        for token in tokens:
+            token.step()
         gui.step()
         state = handel_gui_events(gui, state)
 
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 import json
 from pygame.event import Event as PyGameEvent
 from pydantic import BaseModel, Field
@@ -8,29 +8,61 @@ from pydantic import BaseModel, Field
 class Message(BaseModel):
     event: Optional[PyGameEvent] = Field(default=None)
     extra: Optional[Dict[str, Any]] = Field(default=None)
+    seq: Optional[int] = Field(default=None)
 
     class Config:
         arbitrary_types_allowed = True
         extra = "forbid"
 
-    def model_dump_json(self) -> str:
-        return json.dumps(
-            {
-                "event": (
-                    {
-                        "type": self.event.type,
-                        "dict": self.event.__dict__,
-                    }
-                    if self.event
-                    else None
-                ),
-                "extra": self.extra,
-            }
-        )
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "event": (
+                {
+                    "type": self.event.type,
+                    "dict": self.event.__dict__,
+                }
+                if self.event
+                else None
+            ),
+            "extra": self.extra,
+            "seq": self.seq,
+        }
 
     @classmethod
-    def model_validate_json(cls, message_str: str) -> Message:
-        message_dict = json.loads(message_str)
+    def from_dict(cls, message_dict: Dict[str, Any]) -> Message:
         event = message_dict["event"]
         pygame_event = PyGameEvent(event["type"], event["dict"]) if event else None
-        return cls(event=pygame_event, extra=message_dict["extra"])
+        return cls(event=pygame_event, extra=message_dict["extra"], seq=message_dict.get("seq"))
+
+    def model_dump_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def model_validate_json(cls, message_str: str) -> Message:
+        return cls.from_dict(json.loads(message_str))
+
+
+class MessageBatch(BaseModel):
+    ''' the messages one game tick produced, sent as a single frame, and the session state version after them '''
+
+    seq: Optional[int] = Field(default=None)
+    version: Optional[int] = Field(default=None)
+    messages: List[Message] = Field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"batch": self.seq, "version": self.version, "messages": [message.to_dict() for message in self.messages]}
+
+    @classmethod
+    def from_dict(cls, batch_dict: Dict[str, Any]) -> MessageBatch:
+        return cls(
+            seq=batch_dict["batch"],
+            version=batch_dict.get("version"),
+            messages=[Message.from_dict(message) for message in batch_dict["messages"]],
+        )
+
+    def model_dump_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def model_validate_json(cls, batch_str: str) -> MessageBatch:
+        return cls.from_dict(json.loads(batch_str))
@@ -1,15 +1,35 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from math import ceil, floor, hypot
+import base64
+import zlib
 
-
+import numpy as np
 import pygame
 from pygame import Vector2
 
+import custom_events as CustomPyGameEvents
+from models import Message
+from spatial_index import Bounds
+from progressive_scaler import zoom_is_idle, REFINE_DELAY_MS
+
 DARK_COLOR = (0, 0, 0)
+DEFAULT_FOG_CELL_SIZE = 8
+DEFAULT_BRUSH_RADIUS = 40
+# a mask without a world size grows by this many cells at a time
+FOG_GROW_CELLS = 64
+
+# shapes a fog operation can carry, with their params in world coordinates
+# rect: [x0, y0, x1, y1], circle: [x, y, radius], polygon: [x0, y0, x1, y1, ...]
+FOG_SHAPES = ("rect", "circle", "polygon")
+
+CellRect = Tuple[int, int, int, int]
+
 
 class ObscuringRect:
     def __init__(self):
         self.pos1 = Vector2()
         self.pos2 = Vector2()
-    
+
     def handle_event(self, event):
         pass
 
@@ -17,10 +37,300 @@ class ObscuringRect:
         pygame.draw.rect(win, DARK_COLOR, (self.pos1, self.pos2 - self.pos1))
 
 
-class Obscurers:
-    def __init__(self):
-        self.rects = []
-    
-    def 
+def fog_message(reveal: bool, shape: str, params: Sequence[float]) -> Message:
+    event_type = CustomPyGameEvents.FOG_REVEAL if reveal else CustomPyGameEvents.FOG_HIDE
+    return Message(
+        event=pygame.event.Event(event_type),
+        extra={"shape": shape, "params": [round(value, 2) for value in params]},
+    )
+
+
+class FogMask:
+    '''
+    Visibility bitmask over a map, one cell per cell_size world pixels, True where revealed.
+    Reveal and hide operations only touch the cells inside the shape's bounds.
+    Without a world size the mask grows to whatever the operations reach, for holders that never load the map.
+    '''
+
+    def __init__(self, world_size: Optional[Tuple[int, int]] = None, cell_size: int = DEFAULT_FOG_CELL_SIZE) -> None:
+        self.cell_size: int = cell_size
+        self._growable: bool = world_size is None
+        self.cols: int = 0 if world_size is None else max(1, ceil(world_size[0] / cell_size))
+        self.rows: int = 0 if world_size is None else max(1, ceil(world_size[1] / cell_size))
+        self.mask: np.ndarray = np.zeros((self.rows, self.cols), dtype=bool)
+
+    @property
+    def world_size(self) -> Tuple[int, int]:
+        return self.cols * self.cell_size, self.rows * self.cell_size
+
+    def _grow(self, cols: int, rows: int) -> None:
+        if cols <= self.cols and rows <= self.rows:
+            return
+        # in whole chunks, a stroke creeping outwards does not reallocate every stamp
+        cols = max(self.cols, -(-cols // FOG_GROW_CELLS) * FOG_GROW_CELLS)
+        rows = max(self.rows, -(-rows // FOG_GROW_CELLS) * FOG_GROW_CELLS)
+        mask = np.zeros((rows, cols), dtype=bool)
+        mask[:self.rows, :self.cols] = self.mask
+        self.mask, self.cols, self.rows = mask, cols, rows
+
+    def _cell_range(self, bounds: Bounds) -> Optional[CellRect]:
+        x0, y0, x1, y1 = bounds
+        if self._growable:
+            self._grow(ceil(x1 / self.cell_size), ceil(y1 / self.cell_size))
+        c0 = max(0, floor(x0 / self.cell_size))
+        r0 = max(0, floor(y0 / self.cell_size))
+        c1 = min(self.cols, ceil(x1 / self.cell_size))
+        r1 = min(self.rows, ceil(y1 / self.cell_size))
+        if c0 >= c1 or r0 >= r1:
+            return None
+        return c0, r0, c1, r1
+
+    def _cell_centers(self, cells: CellRect) -> Tuple[np.ndarray, np.ndarray]:
+        c0, r0, c1, r1 = cells
+        xs = (np.arange(c0, c1) + 0.5) * self.cell_size
+        ys = (np.arange(r0, r1) + 0.5) * self.cell_size
+        return np.meshgrid(xs, ys)
+
+    def _paint(self, cells: CellRect, covered: Optional[np.ndarray], reveal: bool) -> None:
+        c0, r0, c1, r1 = cells
+        region = self.mask[r0:r1, c0:c1]
+        if covered is None:
+            region[...] = reveal
+        else:
+            region[covered] = reveal
+
+    def rect(self, bounds: Bounds, reveal: bool = True) -> Optional[Bounds]:
+        x0, y0, x1, y1 = bounds
+        bounds = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        cells = self._cell_range(bounds)
+        if cells is None:
+            return None
+        self._paint(cells, None, reveal)
+        return bounds
+
+    def circle(self, center: Tuple[float, float], radius: float, reveal: bool = True) -> Optional[Bounds]:
+        x, y = center
+        bounds = (x - radius, y - radius, x + radius, y + radius)
+        cells = self._cell_range(bounds)
+        if cells is None:
+            return None
+        xs, ys = self._cell_centers(cells)
+        self._paint(cells, (xs - x) ** 2 + (ys - y) ** 2 <= radius * radius, reveal)
+        return bounds
+
+    def polygon(self, points: Sequence[Tuple[float, float]], reveal: bool = True) -> Optional[Bounds]:
+        vertices = np.asarray(points, dtype=float)
+        if len(vertices) < 3:
+            return None
+        (x0, y0), (x1, y1) = vertices.min(axis=0), vertices.max(axis=0)
+        bounds = (float(x0), float(y0), float(x1), float(y1))
+        cells = self._cell_range(bounds)
+        if cells is None:
+            return None
+
+        # even-odd rule, each edge flips the cells whose rightward ray crosses it
+        xs, ys = self._cell_centers(cells)
+        inside = np.zeros(xs.shape, dtype=bool)
+        for (ax, ay), (bx, by) in zip(vertices, np.roll(vertices, -1, axis=0)):
+            if ay == by:
+                continue
+            crosses = (ay > ys) != (by > ys)
+            inside ^= crosses & (xs < ax + (bx - ax) * (ys - ay) / (by - ay))
+        self._paint(cells, inside, reveal)
+        return bounds
+
+    def apply(self, shape: str, params: Sequence[float], reveal: bool) -> Optional[Bounds]:
+        ''' applies a fog operation, returns the world bounds it touched '''
+        if shape == "rect":
+            return self.rect(tuple(params), reveal)
+        if shape == "circle":
+            x, y, radius = params
+            return self.circle((x, y), radius, reveal)
+        if shape == "polygon":
+            return self.polygon(list(zip(params[0::2], params[1::2])), reveal)
+        raise ValueError(f"Unknown fog shape: {shape}")
+
+    def apply_message(self, message: Message) -> Optional[Bounds]:
+        reveal = message.event.type == CustomPyGameEvents.FOG_REVEAL
+        return self.apply(message.extra["shape"], message.extra["params"], reveal)
+
+    def pack(self) -> Dict[str, Any]:
+        ''' the mask as bit-packed, deflated cells, a few bytes for the large uniform areas fog tends to have '''
+        cells = zlib.compress(np.packbits(self.mask).tobytes())
+        return {"cell_size": self.cell_size, "cols": self.cols, "rows": self.rows, "cells": base64.b64encode(cells).decode()}
+
+    @classmethod
+    def unpack(cls, packed: Dict[str, Any]) -> "FogMask":
+        fog = cls(None, packed["cell_size"])
+        fog.cols, fog.rows = packed["cols"], packed["rows"]
+        cells = np.frombuffer(zlib.decompress(base64.b64decode(packed["cells"])), dtype=np.uint8)
+        fog.mask = np.unpackbits(cells, count=fog.rows * fog.cols).astype(bool).reshape(fog.rows, fog.cols)
+        return fog
+
+
+class FogOfWar(FogMask):
+    '''
+    The fog a screen draws: operations mark the cells they touch dirty and
+    the overlay holding one fog pixel per cell is re-rasterized for the dirty regions on the next draw.
+    The overlay scaled to the window is kept as well: while a stroke goes on only the cells it painted are
+    rescaled into it, once painting pauses for refine_delay_ms the whole of it is smoothscaled again,
+    as patches scaled on their own do not line up exactly with their neighbours.
+    '''
+
+    def __init__(
+        self,
+        world_size: Tuple[int, int],
+        cell_size: int = DEFAULT_FOG_CELL_SIZE,
+        alpha: int = 255,
+        color=DARK_COLOR,
+        refine_delay_ms: int = REFINE_DELAY_MS,
+    ) -> None:
+        super().__init__(world_size, cell_size)
+        self.alpha: int = alpha
+        self.refine_delay_ms: int = refine_delay_ms
+
+        self._overlay: pygame.Surface = pygame.Surface((self.cols, self.rows), pygame.SRCALPHA)
+        self._overlay.fill((*color, alpha))
+        self._dirty: List[CellRect] = []
+        # rasterized into the overlay but not yet rescaled into the scaled overlay
+        self._stale: List[CellRect] = []
+        self._scaled_key: Tuple = None
+        self._scaled: pygame.Surface = None
+        # when the scaled overlay was last patched, None once it is whole again
+        self._patched_ms: Optional[int] = None
+
+    def _paint(self, cells: CellRect, covered: Optional[np.ndarray], reveal: bool) -> None:
+        super()._paint(cells, covered, reveal)
+        self._dirty.append(cells)
+
+    def load(self, packed: Dict[str, Any]) -> None:
+        ''' replaces the whole mask with a packed one, sampled at this fog's cell size '''
+        synced = FogMask.unpack(packed)
+        # the synced cell under the center of each of our cells, rows and columns past its end stay hidden
+        rows = ((np.arange(self.rows) + 0.5) * self.cell_size // synced.cell_size).astype(int)
+        cols = ((np.arange(self.cols) + 0.5) * self.cell_size // synced.cell_size).astype(int)
+        rows, cols = rows[rows < synced.rows], cols[cols < synced.cols]
+        self.mask[...] = False
+        self.mask[:len(rows), :len(cols)] = synced.mask[np.ix_(rows, cols)]
+        self._dirty.append((0, 0, self.cols, self.rows))
+
+    def _rasterize(self) -> None:
+        if not self._dirty:
+            return
+        alpha = pygame.surfarray.pixels_alpha(self._overlay)
+        for c0, r0, c1, r1 in self._dirty:
+            # surfarray views are indexed (x, y)
+            alpha[c0:c1, r0:r1] = np.where(self.mask[r0:r1, c0:c1].T, 0, self.alpha)
+        del alpha
+        self._stale.extend(self._dirty)
+        self._dirty.clear()
+
+    @property
+    def refine_due(self) -> bool:
+        ''' True once painting paused long enough for the next draw to smoothscale the whole overlay '''
+        return self._patched_ms is not None and zoom_is_idle(self._patched_ms, self.refine_delay_ms)
+
+    def _rescale(self, cells: CellRect, size: Tuple[int, int]) -> None:
+        ''' smoothscales the stale cells into the scaled overlay of the visible cells, which is size pixels large '''
+        c0, r0, c1, r1 = cells
+        kx, ky = size[0] / (c1 - c0), size[1] / (r1 - r0)
+        for dc0, dr0, dc1, dr1 in self._stale:
+            # smoothscale blends every pixel with its neighbours: the cells next to the stale ones change too,
+            # and are scaled from a source wider still so the clamped edge of the scaled source is never written back
+            wc0, wr0, wc1, wr1 = max(c0, dc0 - 1), max(r0, dr0 - 1), min(c1, dc1 + 1), min(r1, dr1 + 1)
+            sc0, sr0, sc1, sr1 = max(c0, dc0 - 2), max(r0, dr0 - 2), min(c1, dc1 + 2), min(r1, dr1 + 2)
+            sx0, sy0 = round((sc0 - c0) * kx), round((sr0 - r0) * ky)
+            sx1, sy1 = round((sc1 - c0) * kx), round((sr1 - r0) * ky)
+            write = pygame.Rect(
+                round((wc0 - c0) * kx), round((wr0 - r0) * ky),
+                round((wc1 - c0) * kx) - round((wc0 - c0) * kx), round((wr1 - r0) * ky) - round((wr0 - r0) * ky),
+            )
+            if write.width <= 0 or write.height <= 0:
+                continue
+            region = self._overlay.subsurface((sc0, sr0, sc1 - sc0, sr1 - sr0))
+            scaled = pygame.transform.smoothscale(region, (sx1 - sx0, sy1 - sy0))
+            self._scaled.fill((0, 0, 0, 0), write)
+            # max blending onto cleared pixels copies colour and alpha unchanged
+            self._scaled.blit(scaled, write, write.move(-sx0, -sy0), special_flags=pygame.BLEND_RGBA_MAX)
+        self._stale.clear()
+        self._patched_ms = pygame.time.get_ticks()
+
+    def draw(self, win: pygame.Surface, cam: Vector2, scale: float) -> None:
+        self._rasterize()
+
+        # the whole window rather than the clip, so the dirty rects of a frame share one scaled overlay
+        view = win.get_rect()
+        world_view = (
+            (view.left - cam[0]) / scale, (view.top - cam[1]) / scale,
+            (view.right - cam[0]) / scale, (view.bottom - cam[1]) / scale,
+        )
+        cells = self._cell_range(world_view)
+        if cells is None:
+            return
+
+        c0, r0, c1, r1 = cells
+        step = self.cell_size * scale
+        left, top = round(cam[0] + c0 * step), round(cam[1] + r0 * step)
+        size = (round(cam[0] + c1 * step) - left, round(cam[1] + r1 * step) - top)
+        if size[0] <= 0 or size[1] <= 0:
+            return
+
+        key = (scale, cells, size)
+        if key != self._scaled_key or (self.refine_due and not self._stale):
+            region = self._overlay.subsurface((c0, r0, c1 - c0, r1 - r0))
+            self._scaled = pygame.transform.smoothscale(region, size)
+            self._scaled_key = key
+            self._stale.clear()
+            self._patched_ms = None
+        elif self._stale:
+            self._rescale(cells, size)
+        win.blit(self._scaled, (left, top))
+
+
+class FogBrush:
+    '''
+    Turns the DM's right button drags into fog messages: dragging reveals, holding shift hides.
+    Every motion stamps a circle and, when the pointer moved further than the brush radius,
+    the quad joining the two circles so fast strokes stay continuous.
+    '''
+
+    def __init__(self, canvas, radius: float = DEFAULT_BRUSH_RADIUS) -> None:
+        self.canvas = canvas
+        self.radius: float = radius
+        self._last: Optional[Vector2] = None
+        self._reveal: bool = True
+
+    @property
+    def is_painting(self) -> bool:
+        return self._last is not None
+
+    def feed(self, message: Message) -> List[Message]:
+        event = message.event
+        if event.type == CustomPyGameEvents.RIGHT_MOUSE_CLICK_DOWN:
+            self._reveal = not pygame.key.get_mods() & pygame.KMOD_SHIFT
+            self._last = self.canvas.mouse_in_world(message.extra["pos"])
+            return [self._stamp(self._last)]
+
+        if event.type == CustomPyGameEvents.RIGHT_MOUSE_CLICK_UP:
+            self._last = None
+
+        elif event.type == pygame.MOUSEMOTION and self._last is not None:
+            pos = self.canvas.mouse_in_world(event.pos)
+            radius = self.radius / self.canvas.scale
+            if pos.distance_to(self._last) < radius / 2:
+                return []
+            messages = [self._stroke(self._last, pos, radius)] if pos.distance_to(self._last) > radius else []
+            messages.append(self._stamp(pos))
+            self._last = pos
+            return messages
+
+        return []
 
+    def _stamp(self, pos: Vector2) -> Message:
+        return fog_message(self._reveal, "circle", (pos.x, pos.y, self.radius / self.canvas.scale))
 
+    def _stroke(self, start: Vector2, end: Vector2, radius: float) -> Message:
+        direction = end - start
+        normal = Vector2(-direction.y, direction.x) * (radius / hypot(direction.x, direction.y))
+        corners = (start + normal, end + normal, end - normal, start - normal)
+        return fog_message(self._reveal, "polygon", [value for corner in corners for value in corner])
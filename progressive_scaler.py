@@ -0,0 +1,114 @@
+from typing import Callable, Hashable, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pygame
+
+from sprite_cache import SpriteCache, sprite_cache, quantize_scale
+
+REFINE_DELAY_MS = 150
+
+refine_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="refine")
+
+
+def zoom_is_idle(last_zoom_ms: int, delay_ms: int = REFINE_DELAY_MS) -> bool:
+    return pygame.time.get_ticks() - last_zoom_ms >= delay_ms
+
+
+class ProgressiveScaler:
+    '''
+    Two-phase scaling of a source surface.
+    While scale requests keep arriving the last refined surface is stretched with the
+    cheap nearest-neighbour scale; once requests stop for refine_delay_ms a smoothscale
+    of the source is produced on a worker thread and swapped in by step().
+    With a cache_key scales are quantized and refined surfaces are shared through the sprite cache.
+    '''
+
+    def __init__(
+        self,
+        source: pygame.Surface,
+        scale: float = 1.0,
+        refine: Optional[Callable[[float], pygame.Surface]] = None,
+        refine_delay_ms: int = REFINE_DELAY_MS,
+        cache_key: Optional[Hashable] = None,
+        cache: SpriteCache = sprite_cache,
+    ) -> None:
+        self._source: pygame.Surface = source
+        self._cache_key: Optional[Hashable] = cache_key
+        self._cache: SpriteCache = cache
+        if refine is None:
+            refine = self._smoothscale if cache_key is None else self._cached_smoothscale
+        self._refine_scale: Callable[[float], pygame.Surface] = refine
+        self._refine_delay_ms: int = refine_delay_ms
+
+        scale = self._quantize(scale)
+
+        self._refined: pygame.Surface = self._refine_scale(scale)
+        self._surface: pygame.Surface = self._refined
+        self._target_scale: float = scale
+        self._target_size: Tuple[int, int] = self._refined.get_size()
+        self._last_request_ms: int = 0
+        self._future: Optional[Future] = None
+
+    @property
+    def surface(self) -> pygame.Surface:
+        return self._surface
+
+    @property
+    def is_refined(self) -> bool:
+        return self._surface is self._refined and self._refined.get_size() == self._target_size
+
+    def _scaled_size(self, scale: float) -> Tuple[int, int]:
+        width, height = self._source.get_size()
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def _smoothscale(self, scale: float) -> pygame.Surface:
+        size = self._scaled_size(scale)
+        if size == self._source.get_size():
+            return self._source
+        return pygame.transform.smoothscale(self._source, size)
+
+    def _cached_smoothscale(self, scale: float) -> pygame.Surface:
+        return self._cache.scaled(self._cache_key, self._source, scale)
+
+    def _quantize(self, scale: float) -> float:
+        return scale if self._cache_key is None else quantize_scale(scale)
+
+    def request(self, scale: float) -> pygame.Surface:
+        scale = self._quantize(scale)
+        self._target_scale = scale
+        self._target_size = self._scaled_size(scale)
+        self._last_request_ms = pygame.time.get_ticks()
+
+        if self._cache_key is not None:
+            cached = self._cache.lookup(self._cache_key, scale)
+            if cached is not None:
+                self._refined = cached
+                self._surface = cached
+                return cached
+
+        if self._refined.get_size() == self._target_size:
+            self._surface = self._refined
+        else:
+            self._surface = pygame.transform.scale(self._refined, self._target_size)
+        return self._surface
+
+    def _refine(self, scale: float) -> Tuple[float, pygame.Surface]:
+        return scale, self._refine_scale(scale)
+
+    def step(self) -> bool:
+        ''' swaps in a finished refinement, returns True when the surface changed '''
+        if self._future is not None:
+            if not self._future.done():
+                return False
+            scale, refined = self._future.result()
+            self._future = None
+            if scale == self._target_scale:
+                self._refined = refined
+                self._surface = refined
+                return True
+
+        if self.is_refined or not zoom_is_idle(self._last_request_ms, self._refine_delay_ms):
+            return False
+
+        self._future = refine_executor.submit(self._refine, self._target_scale)
+        return False
@@ -1,45 +1,83 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import asyncio
+from threading import Lock
 import websockets as ws
-from queue import Queue, Empty as QueueEmpty
 from pygame.event import Event as PyGameEvent
-from models import Message
+from models import Message, MessageBatch
+from codec import Codec, DEFAULT_CODEC, hello_frame, parse_accept
 
 
 class Publisher:
+    '''
+    Sends the batches flushed by the game loop from its own asyncio loop.
+    Batches are handed over with call_soon_threadsafe into an asyncio.Queue, so the sender
+    sleeps until there is something to send; stop() enqueues a None sentinel behind them.
+    '''
+
     def __init__(self) -> None:
-        self._message_queue: Queue[Message] = Queue()
         self._uri: str = "ws://localhost:8000/ws/publisher"
-        self._stop_event: asyncio.Event = asyncio.Event()
+        self._codec: Codec = DEFAULT_CODEC
+        self._seq: int = 0
+        self._batch_seq: int = 0
+        self._pending: List[Message] = []
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        # batches flushed before the loop is running wait here
+        self._backlog: List[Optional[MessageBatch]] = []
+        self._lock: Lock = Lock()
 
     def publish(
         self, event: PyGameEvent, extra: Optional[Dict[str, Any]] = None
     ) -> None:
-        message = Message(event=event, extra=extra)
-        self._message_queue.put_nowait(message)
+        message = Message(event=event, extra=extra, seq=self._seq)
+        self._seq += 1
+        self._pending.append(message)
+
+    def flush(self) -> None:
+        ''' sends everything published since the last flush as one frame, called once per game tick '''
+        if not self._pending:
+            return
+        batch = MessageBatch(seq=self._batch_seq, messages=self._pending)
+        self._batch_seq += 1
+        self._pending = []
+        self._hand_off(batch)
+
+    def _hand_off(self, batch: Optional[MessageBatch]) -> None:
+        with self._lock:
+            if self._loop is None:
+                self._backlog.append(batch)
+                return
+            try:
+                self._loop.call_soon_threadsafe(self._queue.put_nowait, batch)
+            except RuntimeError:
+                # the loop already finished, the connection is gone
+                pass
 
-    async def _send_message(
-        self, websocket: ws.WebSocketClientProtocol, message: Message
+    async def _send_batch(
+        self, websocket: ws.WebSocketClientProtocol, batch: MessageBatch
     ) -> None:
         try:
-            await websocket.send(message.model_dump_json())
+            await websocket.send(self._codec.encode_batch(batch))
         except Exception as e:
-            print(f"Error while publishing message: {message}\n{e}")
+            print(f"Error while publishing batch: {batch.seq}\n{e}")
 
     async def _consume_messages(self, websocket: ws.WebSocketClientProtocol) -> None:
-        while not self._stop_event.is_set():
-            try:
-                message = self._message_queue.get_nowait()
-            except QueueEmpty:
-                await asyncio.sleep(0.01)
-                continue
-
-            await self._send_message(websocket, message)
-            self._message_queue.task_done()
+        while (batch := await self._queue.get()) is not None:
+            await self._send_batch(websocket, batch)
 
     async def run(self) -> None:
+        self._queue = asyncio.Queue()
+        with self._lock:
+            for batch in self._backlog:
+                self._queue.put_nowait(batch)
+            self._backlog.clear()
+            self._loop = asyncio.get_running_loop()
+
         try:
             async with ws.connect(self._uri) as websocket:
+                await websocket.send(hello_frame())
+                self._codec, _ = parse_accept(await websocket.recv())
                 await self._consume_messages(websocket)
         except Exception as e:
             print(f"Error while connecting to server: {e}")
@@ -48,9 +86,5 @@ class Publisher:
         asyncio.run(self.run())
 
     def stop(self) -> None:
-        self._stop_event.set()
-        try:
-            while self._message_queue.get_nowait():
-                self._message_queue.task_done()
-        except QueueEmpty:
-            pass
+        ''' lets the batches already flushed go out, then closes the connection '''
+        self._hand_off(None)
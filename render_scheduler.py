@@ -0,0 +1,42 @@
+from typing import List, Optional
+
+import pygame
+
+MAX_DIRTY_RECTS = 4
+DIRTY_RECT_MARGIN = 2
+
+
+class RenderScheduler:
+    '''
+    Collects the screen regions invalidated since the last frame.
+    A frame with nothing invalidated is skipped, otherwise only the dirty rects are redrawn and pushed to the display.
+    '''
+
+    def __init__(self, max_rects: int = MAX_DIRTY_RECTS) -> None:
+        self._max_rects: int = max_rects
+        self._rects: List[pygame.Rect] = []
+        self._full: bool = True
+
+    @property
+    def needs_redraw(self) -> bool:
+        return self._full or bool(self._rects)
+
+    def invalidate(self, rect: Optional[pygame.Rect] = None) -> None:
+        ''' marks rect as dirty, or the whole window when rect is None '''
+        if rect is None:
+            self._full = True
+        elif not self._full:
+            self._rects.append(pygame.Rect(rect).inflate(2 * DIRTY_RECT_MARGIN, 2 * DIRTY_RECT_MARGIN))
+
+    def flush(self, screen_rect: pygame.Rect) -> List[pygame.Rect]:
+        if self._full:
+            rects = [pygame.Rect(screen_rect)]
+        else:
+            rects = [rect.clip(screen_rect) for rect in self._rects]
+            rects = [rect for rect in rects if rect.width and rect.height]
+            if len(rects) > self._max_rects:
+                rects = [rects[0].unionall(rects[1:])]
+
+        self._rects = []
+        self._full = False
+        return rects
@@ -0,0 +1,50 @@
+from typing import Deque, Optional
+from collections import deque
+
+import pygame
+
+import custom_events as CustomPyGameEvents
+from models import Message, MessageBatch
+from session_state import SessionState
+from coalescer import EventCoalescer
+from obscurers import DEFAULT_FOG_CELL_SIZE
+
+DEFAULT_REPLAY_SIZE = 512
+
+# the DM sends these when a gesture ends, the input that led there no longer needs replaying
+SUPERSEDING_EVENTS = (CustomPyGameEvents.CAMERA_STATE, CustomPyGameEvents.TOKEN_STATE)
+# meant for whoever was connected when they were sent
+NOT_REPLAYED = (pygame.QUIT,)
+
+
+class ReplayLog:
+    '''
+    What a subscriber joining late needs to catch up: the session state, which the durable messages
+    are applied to, plus a bounded ring of the transient messages published since the last gesture ended.
+    The ring is coalesced as it fills, idle pointer motion leaves the latest position rather than its whole path.
+    Every recorded batch is tagged with the state version it leaves behind.
+    '''
+
+    def __init__(self, size: int = DEFAULT_REPLAY_SIZE, fog_cell_size: int = DEFAULT_FOG_CELL_SIZE) -> None:
+        self._tail: Deque[Message] = deque(maxlen=size)
+        self._coalescer: EventCoalescer = EventCoalescer()
+        self.state: SessionState = SessionState(fog_cell_size=fog_cell_size)
+        self.seq: Optional[int] = None
+
+    def record(self, batch: MessageBatch) -> None:
+        for message in batch.messages:
+            event_type = message.event.type
+            if not self.state.apply(message) and event_type not in NOT_REPLAYED:
+                previous = [self._tail.pop()] if self._tail else []
+                self._tail.extend(self._coalescer.coalesce([*previous, message]))
+            if event_type in SUPERSEDING_EVENTS:
+                self._tail.clear()
+        batch.version = self.state.version
+        if batch.seq is not None:
+            self.seq = batch.seq
+
+    def replay(self) -> Optional[MessageBatch]:
+        ''' the state as one SYNC_STATE message followed by the tail, None when there is nothing to catch up on '''
+        if self.state.version == 0 and not self._tail:
+            return None
+        return MessageBatch(seq=self.seq, version=self.state.version, messages=[self.state.sync_message(), *self._tail])
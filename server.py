@@ -1,9 +1,32 @@
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from contextlib import asynccontextmanager
+import asyncio
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from broker import MessageBroker
+from settings import SettingsManager
+from codec import Codec, Frame, DEFAULT_CODEC, parse_hello, select_codec, accept_frame
 
+# subscribers that never say hello get JSON after this long
+HELLO_TIMEOUT = 1.0
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # settings are read when the server starts, importing this module has no side effects
+    settings = SettingsManager().settings
+    network_settings = settings.network
+    app.state.broker = MessageBroker(
+        network_settings.subscriber_queue_size,
+        network_settings.overflow_policy,
+        network_settings.replay_size,
+        network_settings.resume_window,
+        settings.graphics.fog_cell_size,
+    )
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -12,29 +35,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-broker = MessageBroker()
+async def receive_frame(websocket: WebSocket) -> Frame:
+    data = await websocket.receive()
+    if data["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(data.get("code", 1000))
+    return data["text"] if data.get("text") is not None else data["bytes"]
+
+
+async def negotiate(
+    websocket: WebSocket, timeout: Optional[float] = None, epoch: Optional[str] = None
+) -> Tuple[Codec, Optional[Frame], Dict[str, Any]]:
+    '''
+    Picks the codec of a connection from its hello frame, which is returned as well.
+    Clients predating the handshake get JSON and an empty hello, their first frame is returned to be handled as a message.
+    '''
+    try:
+        frame = await asyncio.wait_for(receive_frame(websocket), timeout)
+    except asyncio.TimeoutError:
+        return DEFAULT_CODEC, None, {}
+
+    hello = parse_hello(frame)
+    if hello is None:
+        return DEFAULT_CODEC, frame, {}
+    codec = select_codec(hello.get("codecs", []))
+    await websocket.send_text(accept_frame(codec, epoch))
+    return codec, None, hello
+
+
+@app.get("/state")
+async def session_state() -> dict:
+    ''' the current session state, its version matches the version of the batches subscribers receive '''
+    return app.state.broker.state.model_dump(mode="json")
+
+
+@app.get("/stats/subscribers")
+async def subscriber_stats() -> list:
+    return app.state.broker.stats()
 
 
 @app.websocket("/ws/subscriber")
 async def websocket_subscribe(websocket: WebSocket) -> None:
+    broker: MessageBroker = app.state.broker
     await websocket.accept()
-    await broker.register(websocket)
 
     try:
+        codec, _, hello = await negotiate(websocket, HELLO_TIMEOUT, broker.epoch)
+        await broker.register(websocket, codec, hello.get("resume_from"), hello.get("epoch"))
         while True:
             # holding the connection open
-            _ = await websocket.receive_text()
+            _ = await receive_frame(websocket)
     except WebSocketDisconnect:
         await broker.unregister(websocket)
 
 
 @app.websocket("/ws/publisher")
 async def websocket_publish(websocket: WebSocket) -> None:
+    broker: MessageBroker = app.state.broker
     await websocket.accept()
 
     try:
+        codec, frame, _ = await negotiate(websocket)
+        if frame is not None:
+            await broker.publish(codec.decode_batch(frame))
         while True:
-            message = await websocket.receive_text()
-            await broker.publish(message)
+            frame = await receive_frame(websocket)
+            await broker.publish(codec.decode_batch(frame))
     except WebSocketDisconnect:
         pass
@@ -0,0 +1,124 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from pygame.event import Event as PyGameEvent
+from pydantic import BaseModel, Field, field_serializer, field_validator
+
+import custom_events as CustomPyGameEvents
+from models import Message
+from obscurers import FogMask, DEFAULT_FOG_CELL_SIZE
+
+FOG_EVENTS = (CustomPyGameEvents.FOG_REVEAL, CustomPyGameEvents.FOG_HIDE)
+
+
+class CameraState(BaseModel):
+    cam: Tuple[float, float] = (0.0, 0.0)
+    scale: float = 1.0
+
+
+class TokenState(BaseModel):
+    id: int
+    file: str
+    pos: Tuple[float, float]
+    scale: float = 1.0
+
+
+class SessionState(BaseModel):
+    '''
+    The canonical state of the session as the server sees it, built by applying the durable messages
+    the DM publishes. Every change bumps the version; messages that change nothing durable are left to the caller.
+    '''
+
+    version: int = 0
+    fog_cell_size: int = DEFAULT_FOG_CELL_SIZE
+    map: Optional[str] = None
+    walls: Optional[List[Any]] = None
+    grid_type: Optional[str] = None
+    grid_color: Optional[List[int]] = None
+    grid_size: Optional[float] = None
+    camera: Optional[CameraState] = None
+    tokens: Dict[int, TokenState] = Field(default_factory=dict)
+    # the fog mask of every map, strokes are applied as they come so the state stays the size of the maps, not of their history
+    fog: Dict[str, FogMask] = Field(default_factory=dict)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @field_validator("fog", mode="before")
+    @classmethod
+    def _unpack_fog(cls, fog: Dict[str, Any]) -> Dict[str, FogMask]:
+        return {name: mask if isinstance(mask, FogMask) else FogMask.unpack(mask) for name, mask in fog.items()}
+
+    @field_serializer("fog")
+    def _pack_fog(self, fog: Dict[str, FogMask]) -> Dict[str, Dict[str, Any]]:
+        return {name: mask.pack() for name, mask in fog.items()}
+
+    def apply(self, message: Message) -> bool:
+        ''' applies a durable message, returns False for messages that are not part of the state '''
+        event_type = message.event.type
+        extra = message.extra or {}
+
+        if event_type == CustomPyGameEvents.CHANGE_MAP_SPECIFIC:
+            self.map = extra["map"]
+            # entering a map loads its walls from disk again
+            self.walls = None
+        elif event_type == CustomPyGameEvents.SET_WALLS:
+            self.walls = extra["walls"]
+        elif event_type == CustomPyGameEvents.CHANGE_GRID_TYPE and "grid_type" in extra:
+            self.grid_type = extra["grid_type"]
+        elif event_type == CustomPyGameEvents.CHANGE_GRID_COLOR:
+            self.grid_color = list(extra["color"])
+        elif event_type == CustomPyGameEvents.CHANGE_GRID_SIZE:
+            self.grid_size = extra["size"]
+        elif event_type == CustomPyGameEvents.CAMERA_STATE:
+            self.camera = CameraState(cam=extra["cam"], scale=extra["scale"])
+        elif event_type == CustomPyGameEvents.ADD_TOKEN and "id" in extra:
+            self.tokens[extra["id"]] = TokenState(id=extra["id"], file=extra["file"], pos=extra["world_pos"])
+        elif event_type == CustomPyGameEvents.TOKEN_STATE and extra["id"] in self.tokens:
+            token = self.tokens[extra["id"]]
+            token.pos = tuple(extra["pos"])
+            token.scale = extra["scale"]
+        elif event_type in FOG_EVENTS:
+            # no screen shows fog drawn before any map was
+            if self.map is not None:
+                fog = self.fog.setdefault(self.map, FogMask(cell_size=self.fog_cell_size))
+                fog.apply_message(message)
+        else:
+            return False
+
+        self.version += 1
+        return True
+
+    def to_messages(self) -> List[Message]:
+        ''' the fewest messages that take a screen from nothing to this state '''
+        messages = []
+        if self.map is not None:
+            messages.append(_message(CustomPyGameEvents.CHANGE_MAP_SPECIFIC, map=self.map))
+        if self.walls is not None:
+            messages.append(_message(CustomPyGameEvents.SET_WALLS, walls=self.walls))
+        # every map's fog as its mask, the screen keeps the ones it has not loaded for when the DM flips there
+        messages.extend(_message(CustomPyGameEvents.FOG_STATE, map=name, **fog.pack()) for name, fog in self.fog.items())
+
+        if self.grid_type is not None:
+            messages.append(_message(CustomPyGameEvents.CHANGE_GRID_TYPE, grid_type=self.grid_type))
+        if self.grid_color is not None:
+            messages.append(_message(CustomPyGameEvents.CHANGE_GRID_COLOR, color=self.grid_color))
+        if self.grid_size is not None:
+            messages.append(_message(CustomPyGameEvents.CHANGE_GRID_SIZE, size=self.grid_size))
+        if self.camera is not None:
+            messages.append(_message(CustomPyGameEvents.CAMERA_STATE, cam=list(self.camera.cam), scale=self.camera.scale))
+
+        for token in self.tokens.values():
+            messages.append(_message(
+                CustomPyGameEvents.ADD_TOKEN, file=token.file, pos=[0, 0], id=token.id, world_pos=list(token.pos)
+            ))
+            if token.scale != 1.0:
+                messages.append(_message(CustomPyGameEvents.TOKEN_STATE, id=token.id, pos=list(token.pos), scale=token.scale))
+        return messages
+
+    def sync_message(self) -> Message:
+        ''' the whole state as one SYNC_STATE message '''
+        return _message(CustomPyGameEvents.SYNC_STATE, **self.model_dump(mode="json"))
+
+
+def _message(event_type: int, **extra: Any) -> Message:
+    return Message(event=PyGameEvent(event_type), extra=extra)
@@ -3,6 +3,7 @@ from os import PathLike
 from pathlib import Path
 import json
 from pydantic import BaseModel, Field
+from common import OverflowPolicy
 
 PositiveInt = Annotated[int, Field(gt=0)]
 PositiveDecimal = Annotated[float, Field(gt=0)]
@@ -28,10 +29,30 @@ class SoundSettings(BaseModel):
     mute: bool = Field(False, description="Mute all sounds")
 
 
+class GraphicsSettings(BaseModel):
+    tiled_map: bool = Field(True, description="Render maps as viewport-culled tiles instead of one zoomed surface")
+    tile_size: PositiveInt = Field(512, description="Edge length in pixels of a map tile")
+    tile_cache_budget_mb: PositiveInt = Field(256, description="Memory budget in MB for cached map tiles")
+    map_cache_budget_mb: PositiveInt = Field(1024, description="Memory budget in MB for decoded maps kept in memory")
+    zoom_refine_delay_ms: PositiveInt = Field(150, description="Idle time after zooming before high quality rescaling starts")
+    fog_cell_size: PositiveInt = Field(8, description="Edge length in map pixels of a fog of war cell")
+    fog_dm_alpha: int = Field(128, ge=0, le=255, description="Opacity of the fog of war and darkness on the DM screen")
+    token_vision_radius: float = Field(0.0, ge=0.0, description="Sight radius in map pixels of new tokens, 0 disables dynamic lighting")
+
+
+class NetworkSettings(BaseModel):
+    subscriber_queue_size: PositiveInt = Field(256, description="Batches the broker queues per subscriber before the overflow policy applies")
+    overflow_policy: OverflowPolicy = Field(OverflowPolicy.DROP_OLDEST_MOTION, description="What a full subscriber queue gives up: oldest motion, coalesced backlog or the connection")
+    replay_size: PositiveInt = Field(512, description="Recent transient messages replayed to a new subscriber after the durable state snapshot")
+    resume_window: PositiveInt = Field(1024, description="Recent batches kept so a reconnecting subscriber gets only what it missed")
+
+
 class GameSettings(BaseModel):
     resolution: ResolutionSettings = Field(ResolutionSettings(), description="Settings related to the game's resolution")
     keyboard: KeyboardSettings = Field(KeyboardSettings(), description="Keyboard settings including key bindings")
     sound: SoundSettings = Field(SoundSettings(), description="Sound settings for the game")
+    graphics: GraphicsSettings = Field(GraphicsSettings(), description="Rendering and caching settings")
+    network: NetworkSettings = Field(NetworkSettings(), description="Broker fan-out settings")
 
 
 class SettingsManager:
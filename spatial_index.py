@@ -0,0 +1,81 @@
+from typing import Dict, Hashable, Iterator, List, Set, Tuple
+from collections import defaultdict
+from math import floor
+
+DEFAULT_CELL_SIZE = 128.0
+
+Bounds = Tuple[float, float, float, float]
+Cell = Tuple[int, int]
+
+
+class SpatialHash:
+    ''' uniform grid of buckets mapping axis aligned bounds (x0, y0, x1, y1) to the items they contain '''
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE) -> None:
+        self._cell_size: float = cell_size
+        self._cells: Dict[Cell, Set[Hashable]] = defaultdict(set)
+        self._bounds: Dict[Hashable, Bounds] = {}
+
+    def __len__(self) -> int:
+        return len(self._bounds)
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._bounds
+
+    def bounds(self, item: Hashable) -> Bounds:
+        return self._bounds[item]
+
+    def _cells_of(self, bounds: Bounds) -> Iterator[Cell]:
+        x0, y0, x1, y1 = bounds
+        size = self._cell_size
+        for cx in range(floor(x0 / size), floor(x1 / size) + 1):
+            for cy in range(floor(y0 / size), floor(y1 / size) + 1):
+                yield cx, cy
+
+    def update(self, item: Hashable, bounds: Bounds) -> None:
+        old = self._bounds.get(item)
+        if old == bounds:
+            return
+        if old is not None:
+            self._discard(item, old)
+        self._bounds[item] = bounds
+        for cell in self._cells_of(bounds):
+            self._cells[cell].add(item)
+
+    def _discard(self, item: Hashable, bounds: Bounds) -> None:
+        for cell in self._cells_of(bounds):
+            bucket = self._cells.get(cell)
+            if bucket is None:
+                continue
+            bucket.discard(item)
+            if not bucket:
+                del self._cells[cell]
+
+    def remove(self, item: Hashable) -> None:
+        bounds = self._bounds.pop(item, None)
+        if bounds is not None:
+            self._discard(item, bounds)
+
+    def clear(self) -> None:
+        self._cells.clear()
+        self._bounds.clear()
+
+    def query_point(self, point: Tuple[float, float]) -> List[Hashable]:
+        x, y = point
+        bucket = self._cells.get((floor(x / self._cell_size), floor(y / self._cell_size)), ())
+        result = []
+        for item in bucket:
+            x0, y0, x1, y1 = self._bounds[item]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                result.append(item)
+        return result
+
+    def query_rect(self, bounds: Bounds) -> Set[Hashable]:
+        x0, y0, x1, y1 = bounds
+        result = set()
+        for cell in self._cells_of(bounds):
+            for item in self._cells.get(cell, ()):
+                ix0, iy0, ix1, iy1 = self._bounds[item]
+                if ix0 <= x1 and ix1 >= x0 and iy0 <= y1 and iy1 >= y0:
+                    result.add(item)
+        return result
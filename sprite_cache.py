@@ -0,0 +1,63 @@
+from typing import Dict, Hashable, Tuple
+from concurrent.futures import Future
+from threading import Lock
+from math import log2
+
+import pygame
+
+from surface_cache import SurfaceCache
+
+SCALE_STEPS_PER_OCTAVE = 16
+DEFAULT_SPRITE_CACHE_BUDGET = 128 * 1024 * 1024
+
+SpriteKey = Tuple[Hashable, float]
+
+
+def quantize_scale(scale: float) -> float:
+    ''' snaps scale to a logarithmic grid so nearby zoom levels share sprites '''
+    return 2 ** (round(log2(scale) * SCALE_STEPS_PER_OCTAVE) / SCALE_STEPS_PER_OCTAVE)
+
+
+class SpriteCache(SurfaceCache):
+    ''' scaled sprites shared by every token showing the same image, keyed by image id and quantized scale '''
+
+    def __init__(self, budget: int = DEFAULT_SPRITE_CACHE_BUDGET) -> None:
+        super().__init__(budget)
+        self._in_flight: Dict[SpriteKey, Future] = {}
+        self._in_flight_lock: Lock = Lock()
+
+    def lookup(self, image_id: Hashable, scale: float) -> pygame.Surface:
+        return self.get((image_id, quantize_scale(scale)))
+
+    def scaled(self, image_id: Hashable, source: pygame.Surface, scale: float) -> pygame.Surface:
+        key = (image_id, quantize_scale(scale))
+        sprite = self.get(key)
+        if sprite is not None:
+            return sprite
+
+        # concurrent requests for the same sprite wait for the first one instead of scaling again
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._in_flight[key] = future
+        if not is_owner:
+            return future.result()
+
+        try:
+            width, height = source.get_size()
+            size = (max(1, round(width * key[1])), max(1, round(height * key[1])))
+            sprite = source if size == source.get_size() else pygame.transform.smoothscale(source, size)
+            self.put(key, sprite)
+            future.set_result(sprite)
+            return sprite
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.pop(key, None)
+
+
+sprite_cache = SpriteCache()
@@ -1,48 +1,133 @@
 from typing import Optional
 import asyncio
+import random
+from threading import Lock
 import websockets as ws
 from queue import Queue, Empty as QueueEmpty
-from models import Message
+import custom_events as CustomPyGameEvents
+from models import MessageBatch
+from session_state import SessionState
+from codec import Codec, DEFAULT_CODEC, hello_frame, parse_accept
+
+RECONNECT_BASE_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5.0
+
+
+def reconnect_delay(attempt: int) -> float:
+    ''' exponential backoff with full jitter, so screens dropped together do not reconnect in lockstep '''
+    return random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt))
 
 
 class Subscriber:
+    '''
+    Receives batches on its own asyncio loop and hands them to the game loop through a queue
+    the game loop drains once per frame. Stopping closes the socket from the asyncio loop,
+    which ends the receive loop without any timeouts.
+    A dropped connection is retried with backoff, resuming from the seq of the last batch received
+    so the broker only sends what was missed.
+    '''
+
     def __init__(self) -> None:
-        self._message_queue: Queue[Message] = Queue()
+        self._message_queue: Queue[MessageBatch] = Queue()
         self._uri: str = "ws://localhost:8000/ws/subscriber"
-        self._stop_event: asyncio.Event = asyncio.Event()
+        self._codec: Codec = DEFAULT_CODEC
+        # seq of the last batch received
+        self.seq: Optional[int] = None
+        # seqs only mean something within the broker instance that numbered them
+        self._epoch: Optional[str] = None
+        # mirror of the server's session state, its version is checked against every batch's
+        self._state: SessionState = SessionState()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._websocket: Optional[ws.WebSocketClientProtocol] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._attempt: int = 0
+        self._stopped: bool = False
+        self._lock: Lock = Lock()
 
-    def get(self) -> Optional[Message]:
+    def get(self) -> Optional[MessageBatch]:
         try:
             return self._message_queue.get_nowait()
         except QueueEmpty:
             return None
 
     async def _consume_messages(self, websocket: ws.WebSocketClientProtocol) -> None:
-        while not self._stop_event.is_set():
+        try:
+            async for frame in websocket:
+                batch = self._codec.decode_batch(frame)
+                self._message_queue.put_nowait(batch)
+                if not self._in_sync(batch):
+                    # a state change went missing, a connection that does not resume starts from a snapshot
+                    self.seq = None
+                    await websocket.close()
+                    return
+                if batch.seq is not None:
+                    self.seq = batch.seq
+        except ws.exceptions.ConnectionClosed:
+            pass
+
+    def _in_sync(self, batch: MessageBatch) -> bool:
+        ''' applies the batch to the mirrored state, False when the versions no longer agree '''
+        for message in batch.messages:
+            if message.event.type == CustomPyGameEvents.SYNC_STATE:
+                self._state = SessionState.model_validate(message.extra)
+            else:
+                self._state.apply(message)
+        return batch.version is None or batch.version == self._state.version
+
+    async def _connect(self) -> None:
+        async with ws.connect(self._uri) as websocket:
+            self._websocket = websocket
+            if self._stopping.is_set():
+                return
+            await websocket.send(hello_frame(resume_from=self.seq, epoch=self._epoch))
+            epoch = self._epoch
+            self._codec, self._epoch = parse_accept(await websocket.recv())
+            if self._epoch != epoch:
+                # a different broker counts versions from scratch, anything it holds comes as a snapshot
+                self._state = SessionState()
+            # the server answered, a later drop starts the backoff over
+            self._attempt = 0
+            await self._consume_messages(websocket)
+
+    async def run(self) -> None:
+        with self._lock:
+            if self._stopped:
+                return
+            self._loop = asyncio.get_running_loop()
+            self._stopping = asyncio.Event()
+
+        while not self._stopping.is_set():
+            try:
+                await self._connect()
+            except Exception as e:
+                print(f"Error while connecting to server: {e}")
+            finally:
+                self._websocket = None
             try:
-                message_str = await asyncio.wait_for(websocket.recv(), timeout=0.1)
-                message = Message.model_validate_json(message_str)
-                self._message_queue.put_nowait(message)
+                await asyncio.wait_for(self._stopping.wait(), reconnect_delay(self._attempt))
             except asyncio.TimeoutError:
                 pass
-            except ws.exceptions.ConnectionClosed:
-                break
-
-    async def run(self) -> None:
-        try:
-            async with ws.connect(self._uri) as websocket:
-                await self._consume_messages(websocket)
-        except Exception as e:
-            print(f"Error while connecting to server: {e}")
+            self._attempt += 1
 
     def start(self) -> None:
         asyncio.run(self.run())
 
+    def _close(self) -> None:
+        self._stopping.set()
+        if self._websocket is not None:
+            asyncio.ensure_future(self._websocket.close())
+
     def stop(self) -> None:
-        self._stop_event.set()
-        if not self._message_queue.empty():
-            try:
-                while self._message_queue.get_nowait():
-                    self._message_queue.task_done()
-            except QueueEmpty:
-                pass
+        with self._lock:
+            self._stopped = True
+            if self._loop is not None:
+                try:
+                    self._loop.call_soon_threadsafe(self._close)
+                except RuntimeError:
+                    pass
+        try:
+            while self._message_queue.get_nowait():
+                self._message_queue.task_done()
+        except QueueEmpty:
+            pass
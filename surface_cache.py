@@ -0,0 +1,60 @@
+from typing import Any, Hashable, Optional
+from collections import OrderedDict
+from threading import Lock
+
+import pygame
+
+
+def surface_bytes(surf: pygame.Surface) -> int:
+    return surf.get_bytesize() * surf.get_width() * surf.get_height()
+
+
+class SurfaceCache:
+    ''' thread-safe LRU cache bounded by a byte budget '''
+
+    def __init__(self, budget: int) -> None:
+        self._budget: int = budget
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+        self._bytes: int = 0
+        self._lock: Lock = Lock()
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    @property
+    def budget(self) -> int:
+        return self._budget
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def sizeof(self, value: Any) -> int:
+        return surface_bytes(value)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= self.sizeof(old)
+            self._items[key] = value
+            self._bytes += self.sizeof(value)
+            while self._bytes > self._budget and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= self.sizeof(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
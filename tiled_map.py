@@ -0,0 +1,130 @@
+from typing import List, Optional, Tuple
+from concurrent.futures import Future
+import math
+
+import pygame
+from pygame import Vector2
+
+from zoom_pyramid import ZoomPyramid
+from surface_cache import SurfaceCache
+from progressive_scaler import refine_executor
+
+DEFAULT_TILE_SIZE = 512
+DEFAULT_TILE_CACHE_BUDGET = 256 * 1024 * 1024
+FAST_TILE = "fast"
+
+
+class TileCache(SurfaceCache):
+    ''' LRU cache of rendered tiles bounded by a byte budget '''
+
+    def __init__(self, budget: int = DEFAULT_TILE_CACHE_BUDGET) -> None:
+        super().__init__(budget)
+
+
+class TiledMap:
+    '''
+    Renders a map as fixed-size screen tiles per zoom level.
+    Only the tiles intersecting the window are materialized, each one resampled
+    from the closest pyramid level, so the full zoomed map never exists in memory.
+    '''
+
+    def __init__(
+        self,
+        pyramid: ZoomPyramid,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        cache: Optional[TileCache] = None,
+    ) -> None:
+        self.pyramid: ZoomPyramid = pyramid
+        self.tile_size: int = tile_size
+        self.cache: TileCache = cache if cache is not None else TileCache()
+
+    @staticmethod
+    def scale_key(scale: float) -> float:
+        return round(scale, 6)
+
+    def visible_tiles(
+        self, win_size: Tuple[int, int], cam: Tuple[float, float], scale: float
+    ) -> List[Tuple[int, int]]:
+        scaled_w, scaled_h = self.pyramid.scaled_size(scale)
+        x0, y0 = max(0.0, -cam[0]), max(0.0, -cam[1])
+        x1, y1 = min(scaled_w, win_size[0] - cam[0]), min(scaled_h, win_size[1] - cam[1])
+        if x1 <= x0 or y1 <= y0:
+            return []
+
+        cols = range(int(x0 // self.tile_size), math.ceil(x1 / self.tile_size))
+        rows = range(int(y0 // self.tile_size), math.ceil(y1 / self.tile_size))
+        return [(col, row) for row in rows for col in cols]
+
+    def render_tile(self, scale: float, col: int, row: int, fast: bool = False) -> pygame.Surface:
+        scaled_w, scaled_h = self.pyramid.scaled_size(scale)
+        x, y = col * self.tile_size, row * self.tile_size
+        width, height = min(self.tile_size, scaled_w - x), min(self.tile_size, scaled_h - y)
+
+        level = self.pyramid.levels[self.pyramid.level_index_for(scale)]
+        level_w, level_h = level.get_size()
+        kx, ky = scaled_w / level_w, scaled_h / level_h
+
+        # source rect in level pixels, widened to whole pixels
+        sx0, sy0 = int(x / kx), int(y / ky)
+        sx1 = min(level_w, math.ceil((x + width) / kx))
+        sy1 = min(level_h, math.ceil((y + height) / ky))
+        chunk = level.subsurface((sx0, sy0, sx1 - sx0, sy1 - sy0))
+        chunk_size = (max(1, round((sx1 - sx0) * kx)), max(1, round((sy1 - sy0) * ky)))
+        if fast:
+            chunk = pygame.transform.scale(chunk, chunk_size)
+        else:
+            chunk = pygame.transform.smoothscale(chunk, chunk_size)
+
+        tile = pygame.Surface((width, height), level.get_flags() & pygame.SRCALPHA, level)
+        tile.blit(chunk, (round(sx0 * kx - x), round(sy0 * ky - y)))
+        return tile
+
+    def get_tile(self, scale: float, col: int, row: int, fast: bool = False) -> pygame.Surface:
+        key = (self.scale_key(scale), col, row)
+        tile = self.cache.get(key)
+        if tile is not None:
+            return tile
+
+        if fast:
+            # low quality tiles are cached apart so a refinement can replace them
+            key += (FAST_TILE,)
+            tile = self.cache.get(key)
+            if tile is not None:
+                return tile
+
+        tile = self.render_tile(scale, col, row, fast)
+        self.cache.put(key, tile)
+        return tile
+
+    def missing_tiles(
+        self, win_size: Tuple[int, int], cam: Vector2, scale: float
+    ) -> List[Tuple[int, int]]:
+        key = self.scale_key(scale)
+        cam = (round(cam[0]), round(cam[1]))
+        return [
+            (col, row)
+            for col, row in self.visible_tiles(win_size, cam, scale)
+            if self.cache.get((key, col, row)) is None
+        ]
+
+    def _refine_tiles(self, scale: float, tiles: List[Tuple[int, int]]) -> None:
+        key = self.scale_key(scale)
+        for col, row in tiles:
+            self.cache.put((key, col, row), self.render_tile(scale, col, row))
+
+    def refine(self, win_size: Tuple[int, int], cam: Vector2, scale: float) -> Optional[Future]:
+        ''' renders the missing high quality visible tiles on a worker thread '''
+        tiles = self.missing_tiles(win_size, cam, scale)
+        if not tiles:
+            return None
+        return refine_executor.submit(self._refine_tiles, scale, tiles)
+
+    def draw(self, win: pygame.Surface, cam: Vector2, scale: float, fast: bool = False) -> None:
+        cam_x, cam_y = round(cam[0]), round(cam[1])
+        win.blits(
+            [
+                (self.get_tile(scale, col, row, fast), (cam_x + col * self.tile_size, cam_y + row * self.tile_size))
+                for col, row in self.visible_tiles(win.get_size(), (cam_x, cam_y), scale)
+            ],
+            doreturn=False,
+        )
@@ -1,20 +1,32 @@
-from typing import List
+from typing import List, Optional
 
+import numpy as np
 import pygame
 from pygame import Vector2
 
+from image_ingest import load_image
+from sprite_cache import sprite_cache
+from token_layer import TokenLayer
+from token_store import TokenStore, TokenHandle
+from spatial_index import SpatialHash
+
 NORMAL_SIZE = 100.0
 
 
-class Token:
-    def __init__(self, pos: Vector2):
+class Token(TokenHandle):
+    ''' handle to a slot of the collection's token store plus the sprite drawn for it '''
+
+    __slots__ = ("image_path", "surf_initial", "surf")
+
+    def __init__(self, store: TokenStore, pos: Vector2):
+        super().__init__(store, store.add(pos))
+        store.items[self.slot] = self
+        self.image_path: str = None
         self.surf_initial: pygame.Surface = None
         self.surf: pygame.Surface = None
-        self.scale: float = 1.0
-        self.pos = pos
 
     def update_surf(self) -> None:
-        self.surf = pygame.transform.smoothscale_by(self.surf_initial, self.scale)
+        self.surf = sprite_cache.scaled(self.image_path, self.surf_initial, self.scale)
 
     def scale_by(self, value: float) -> None:
         self.scale *= value
@@ -27,7 +39,9 @@ class Token:
         self.scale_by(value)
 
     def set_image(self, path: str) -> None:
-        self.surf_initial = pygame.image.load(path)
+        self.image_path = path
+        self.surf_initial = load_image(path)
+        self.radius = self.surf_initial.get_width() / 2
         normal_scale_factor = NORMAL_SIZE / self.surf_initial.get_width()
         self.scale = normal_scale_factor
         self.update_surf()
@@ -42,6 +56,10 @@ class Token:
 class TokenCollection:
     def __init__(self):
         self.tokens: List[Token] = []
+        self.store = TokenStore()
+        # store slots by their bounds, picking only hit tests the few tokens near the pointer
+        self.index = SpatialHash()
+        self.layer = TokenLayer()
 
         self.selected_token: Token = None
         self.token_dragged = False
@@ -51,18 +69,25 @@ class TokenCollection:
         return self.selected_token is not None
 
     def add_token(self, file: str, pos: Vector2) -> None:
-        token = Token(pos)
+        token = Token(self.store, pos)
         token.set_image(file)
         self.tokens.append(token)
+        self.reindex(np.array([token.slot]))
+
+    def reindex(self, slots: Optional[np.ndarray] = None) -> None:
+        store = self.store
+        slots = store.slots() if slots is None else slots
+        reach = (store.radius[slots] * store.scale[slots])[:, None]
+        lows, highs = (store.pos[slots] - reach).tolist(), (store.pos[slots] + reach).tolist()
+        for slot, (x0, y0), (x1, y1) in zip(slots.tolist(), lows, highs):
+            self.index.update(slot, (x0, y0, x1, y1))
 
     def check_for_selected_token(self, pos: Vector2) -> bool:
         if self.token_dragged:
             return True
-        self.selected_token = None
-        for token in self.tokens:
-            if token.pos.distance_to(pos) < token.surf.get_width() / 2:
-                self.selected_token = token
-                break
+        candidates = np.array(self.index.query_point(pos), dtype=np.intp)
+        hits = self.store.hit_test(pos, candidates[np.argsort(self.store.order[candidates])])
+        self.selected_token = self.store.items[hits[0]] if len(hits) else None
         return self.selected_token is not None
 
     def handle_event(self, event) -> None:
@@ -72,6 +97,7 @@ class TokenCollection:
             if event.button in [4, 5]:
                 scale_value = 1.1 if event.button == 4 else 0.9
                 self.selected_token.scale_by(scale_value)
+                self.reindex(np.array([self.selected_token.slot]))
 
             if event.button == 1:
                 self.token_dragged = True
@@ -86,27 +112,31 @@ class TokenCollection:
             if self.token_dragged:
                 mouse_pos = Vector2(event.pos)
                 self.selected_token.pos = mouse_pos + self.drag_offset
+                self.reindex(np.array([self.selected_token.slot]))
 
     def translate(self, vec: Vector2) -> None:
-        for token in self.tokens:
-            token.pos += vec
+        self.store.translate(vec)
+        self.reindex()
 
     def scale_by(self, value: float) -> None:
+        self.store.scale_by(value)
         for token in self.tokens:
-            token.scale_by(value)
+            token.update_surf()
+        self.reindex()
 
     def scale_from(self, value: float, anchor: Vector2) -> None:
+        self.store.scale_from(value, anchor)
         for token in self.tokens:
-            token.scale_from(value, anchor)
+            token.update_surf()
+        self.reindex()
 
     def step(self):
         pass
 
 
     def draw(self, win: pygame.Surface) -> None:
-        for token in self.tokens:
-            token.draw(win)
-            if self.selected_token is token:
-                pygame.draw.circle(
-                    win, (255, 255, 255), token.pos, token.surf.get_width() / 2, 1
-                )
+        rings = []
+        if self.selected_token is not None:
+            rings.append((self.selected_token.pos, self.selected_token.surf.get_width() // 2))
+        centers = self.store.pos[self.store.slots()].tolist()
+        self.layer.draw(win, [(token.surf, center) for token, center in zip(self.tokens, centers)], rings)
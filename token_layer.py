@@ -0,0 +1,176 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary, WeakSet
+
+import pygame
+
+from surface_cache import SurfaceCache
+
+DEFAULT_PAGE_SIZE = 2048
+DEFAULT_MAX_PAGES = 4
+ATLAS_PADDING = 1
+RING_COLOR = (255, 255, 255)
+RING_WIDTH = 1
+# one ring per radius seen, zooming through many levels evicts the least recently drawn
+DEFAULT_RING_CACHE_BUDGET = 16 * 1024 * 1024
+
+Point = Tuple[float, float]
+Slot = Tuple[pygame.Surface, pygame.Rect]
+
+
+class AtlasPage:
+    '''
+    One atlas surface filled shelf by shelf, left to right and top to bottom,
+    in the pixel format of the sprite it was opened for so blits from it take the same path the sprite's would.
+    '''
+
+    def __init__(self, size: int, template: pygame.Surface) -> None:
+        self.surface: pygame.Surface = pygame.Surface((size, size), template.get_flags() & pygame.SRCALPHA, template)
+        self._size: int = size
+        # every shelf is [top, height, next free x]
+        self._shelves: List[List[int]] = []
+
+    def allocate(self, width: int, height: int) -> Optional[pygame.Rect]:
+        width += ATLAS_PADDING
+        height += ATLAS_PADDING
+        if width > self._size or height > self._size:
+            return None
+
+        for shelf in self._shelves:
+            top, shelf_height, x = shelf
+            if height <= shelf_height and x + width <= self._size:
+                shelf[2] += width
+                return pygame.Rect(x, top, width - ATLAS_PADDING, height - ATLAS_PADDING)
+
+        top = self._shelves[-1][0] + self._shelves[-1][1] if self._shelves else 0
+        if top + height > self._size:
+            return None
+        self._shelves.append([top, height, width])
+        return pygame.Rect(0, top, width - ATLAS_PADDING, height - ATLAS_PADDING)
+
+
+class TokenAtlas:
+    '''
+    Packs token sprites into a few large pages so a frame samples from a handful of surfaces.
+    Sprites are packed the second time they are drawn, so the throwaway surfaces of a zoom in
+    progress never reach the atlas. When every page is full the atlas starts over.
+    Opaque sprites get pages of their own, packing them with per-pixel alpha would make every blit of them blend.
+    '''
+
+    def __init__(self, page_size: int = DEFAULT_PAGE_SIZE, max_pages: int = DEFAULT_MAX_PAGES) -> None:
+        self._page_size: int = page_size
+        self._max_pages: int = max_pages
+        # pages by whether they hold per-pixel alpha
+        self._pages: Dict[bool, List[AtlasPage]] = {False: [], True: []}
+        self._slots: WeakKeyDictionary = WeakKeyDictionary()
+        self._seen: WeakSet = WeakSet()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def pages(self) -> int:
+        return sum(len(pages) for pages in self._pages.values())
+
+    def clear(self) -> None:
+        for pages in self._pages.values():
+            pages.clear()
+        self._slots.clear()
+        self._seen.clear()
+
+    def slot(self, sprite: pygame.Surface) -> Slot:
+        ''' the surface and area to blit sprite from '''
+        slot = self._slots.get(sprite)
+        if slot is not None:
+            return slot
+        if sprite not in self._seen:
+            self._seen.add(sprite)
+            return sprite, sprite.get_rect()
+
+        slot = self._pack(sprite)
+        if slot is None:
+            return sprite, sprite.get_rect()
+        self._seen.discard(sprite)
+        self._slots[sprite] = slot
+        return slot
+
+    def _pack(self, sprite: pygame.Surface) -> Optional[Slot]:
+        width, height = sprite.get_size()
+        if width + ATLAS_PADDING > self._page_size or height + ATLAS_PADDING > self._page_size:
+            return None
+        # a colour key belongs to the sprite's surface, a shared page cannot carry it
+        if sprite.get_colorkey() is not None:
+            return None
+
+        alpha = bool(sprite.get_flags() & pygame.SRCALPHA)
+        pages = self._pages[alpha]
+        rect = pages[-1].allocate(width, height) if pages else None
+        if rect is None:
+            if self.pages == self._max_pages:
+                for kind in self._pages.values():
+                    kind.clear()
+                self._slots.clear()
+            pages.append(AtlasPage(self._page_size, sprite))
+            rect = pages[-1].allocate(width, height)
+
+        page = pages[-1].surface
+        if alpha:
+            page.fill((0, 0, 0, 0), rect)
+            # max blending onto cleared pixels copies colour and alpha unchanged
+            page.blit(sprite, rect, special_flags=pygame.BLEND_RGBA_MAX)
+        else:
+            page.blit(sprite, rect)
+        return page, rect
+
+
+class TokenLayer:
+    ''' draws a frame of token sprites with a single blits call and their selection rings with a second one '''
+
+    def __init__(
+        self,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        max_pages: int = DEFAULT_MAX_PAGES,
+        ring_cache_budget: int = DEFAULT_RING_CACHE_BUDGET,
+    ) -> None:
+        self.atlas: TokenAtlas = TokenAtlas(page_size, max_pages)
+        self._rings: SurfaceCache = SurfaceCache(ring_cache_budget)
+
+    def ring(self, radius: int, color=RING_COLOR, width: int = RING_WIDTH) -> pygame.Surface:
+        key = (radius, tuple(color), width)
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = pygame.Surface((2 * radius + 1, 2 * radius + 1), pygame.SRCALPHA)
+            pygame.draw.circle(ring, color, (radius, radius), radius, width)
+            self._rings.put(key, ring)
+        return ring
+
+    def draw(
+        self,
+        win: pygame.Surface,
+        sprites: Sequence[Tuple[pygame.Surface, Point]],
+        rings: Sequence[Tuple[Point, int]] = (),
+    ) -> int:
+        '''
+        sprites holds (sprite, center) pairs in back to front order and rings (center, radius) pairs.
+        Returns the number of sprites drawn after culling against the clip rect.
+        '''
+        clip = win.get_clip()
+        batch = []
+        for sprite, (x, y) in sprites:
+            width, height = sprite.get_size()
+            dest = pygame.Rect(round(x - width / 2), round(y - height / 2), width, height)
+            if dest.colliderect(clip):
+                source, area = self.atlas.slot(sprite)
+                batch.append((source, dest, area))
+        if batch:
+            win.blits(batch, False)
+
+        ring_batch = []
+        for (x, y), radius in rings:
+            ring = self.ring(radius)
+            dest = ring.get_rect(center=(round(x), round(y)))
+            if dest.colliderect(clip):
+                ring_batch.append((ring, dest))
+        if ring_batch:
+            win.blits(ring_batch, False)
+
+        return len(batch)
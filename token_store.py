@@ -0,0 +1,163 @@
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from pygame import Vector2
+
+FLAG_SELECTED = 1
+FLAG_HIDDEN = 2
+
+DEFAULT_CAPACITY = 64
+
+Point = Tuple[float, float]
+
+
+class TokenStore:
+    '''
+    Struct of arrays holding the state of every token: world position, scale, unscaled radius and flags.
+    Bulk operations run over whole arrays; slots of removed tokens are reused by later adds.
+    Every slot also remembers the order it was added in, which is its draw and picking order.
+    '''
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        self.pos: np.ndarray = np.zeros((capacity, 2))
+        self.scale: np.ndarray = np.ones(capacity)
+        self.radius: np.ndarray = np.zeros(capacity)
+        self.flags: np.ndarray = np.zeros(capacity, dtype=np.uint8)
+        self.alive: np.ndarray = np.zeros(capacity, dtype=bool)
+        self.order: np.ndarray = np.zeros(capacity, dtype=np.int64)
+        self.items: List[Any] = [None] * capacity
+
+        self._free: List[int] = []
+        self._size: int = 0
+        self._next_order: int = 0
+        self._slots_cache: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._size - len(self._free)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.alive)
+
+    def _grow(self) -> None:
+        capacity = 2 * self.capacity
+        for name in ("pos", "scale", "radius", "flags", "alive", "order"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.scale[self._size:] = 1.0
+        self.items.extend([None] * (capacity - len(self.items)))
+
+    def add(self, pos: Point = (0.0, 0.0), scale: float = 1.0, radius: float = 0.0, flags: int = 0, item: Any = None) -> int:
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self._size == self.capacity:
+                self._grow()
+            slot = self._size
+            self._size += 1
+
+        self.pos[slot] = pos
+        self.scale[slot] = scale
+        self.radius[slot] = radius
+        self.flags[slot] = flags
+        self.alive[slot] = True
+        self.order[slot] = self._next_order
+        self.items[slot] = item
+        self._next_order += 1
+        self._slots_cache = None
+        return slot
+
+    def remove(self, slot: int) -> None:
+        if not self.alive[slot]:
+            return
+        self.alive[slot] = False
+        self.flags[slot] = 0
+        self.items[slot] = None
+        self._free.append(slot)
+        self._slots_cache = None
+
+    def handle(self, slot: int) -> "TokenHandle":
+        return TokenHandle(self, slot)
+
+    def slots(self) -> np.ndarray:
+        ''' live slots sorted by the order they were added in '''
+        if self._slots_cache is None:
+            live = np.flatnonzero(self.alive[:self._size])
+            self._slots_cache = live[np.argsort(self.order[live], kind="stable")]
+        return self._slots_cache
+
+    def _select(self, slots: Optional[np.ndarray]) -> np.ndarray:
+        return self.slots() if slots is None else slots
+
+    def translate(self, offset: Point, slots: Optional[np.ndarray] = None) -> None:
+        self.pos[self._select(slots)] += offset
+
+    def scale_by(self, value: float, slots: Optional[np.ndarray] = None) -> None:
+        self.scale[self._select(slots)] *= value
+
+    def scale_from(self, value: float, anchor: Point, slots: Optional[np.ndarray] = None) -> None:
+        ''' scales the tokens and their distance to anchor by value '''
+        slots = self._select(slots)
+        anchor = np.asarray(anchor, dtype=float)
+        self.pos[slots] = anchor + (self.pos[slots] - anchor) * value
+        self.scale[slots] *= value
+
+    def world_to_screen(self, cam: Point, canvas_scale: float, slots: Optional[np.ndarray] = None) -> np.ndarray:
+        return np.asarray(cam, dtype=float) + self.pos[self._select(slots)] * canvas_scale
+
+    def hit_test(self, point: Point, slots: Optional[np.ndarray] = None) -> np.ndarray:
+        ''' slots whose circle contains point, in draw order '''
+        slots = self._select(slots)
+        delta = self.pos[slots] - np.asarray(point, dtype=float)
+        reach = self.radius[slots] * self.scale[slots]
+        inside = np.einsum("ij,ij->i", delta, delta) < reach * reach
+        inside &= (self.flags[slots] & FLAG_HIDDEN) == 0
+        return slots[inside]
+
+
+class TokenHandle:
+    ''' view of one token slot that reads and writes the store arrays '''
+
+    __slots__ = ("store", "slot")
+
+    def __init__(self, store: TokenStore, slot: int) -> None:
+        self.store: TokenStore = store
+        self.slot: int = slot
+
+    @property
+    def pos(self) -> Vector2:
+        return Vector2(self.store.pos[self.slot].tolist())
+
+    @pos.setter
+    def pos(self, value: Point) -> None:
+        self.store.pos[self.slot] = value
+
+    @property
+    def scale(self) -> float:
+        return float(self.store.scale[self.slot])
+
+    @scale.setter
+    def scale(self, value: float) -> None:
+        self.store.scale[self.slot] = value
+
+    @property
+    def radius(self) -> float:
+        return float(self.store.radius[self.slot])
+
+    @radius.setter
+    def radius(self, value: float) -> None:
+        self.store.radius[self.slot] = value
+
+    def has_flag(self, flag: int) -> bool:
+        return bool(self.store.flags[self.slot] & flag)
+
+    def set_flag(self, flag: int, value: bool = True) -> None:
+        if value:
+            self.store.flags[self.slot] |= flag
+        else:
+            self.store.flags[self.slot] &= ~np.uint8(flag)
+
+    def remove(self) -> None:
+        self.store.remove(self.slot)
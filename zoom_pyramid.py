@@ -0,0 +1,61 @@
+from typing import List, Tuple
+import math
+
+import pygame
+
+from surface_cache import surface_bytes
+
+MIN_LEVEL_SIZE = 64
+
+
+class ZoomPyramid:
+    ''' power-of-two mipmap of a surface, level i is the source scaled by 2 ** -i '''
+
+    def __init__(self, surf: pygame.Surface, min_size: int = MIN_LEVEL_SIZE) -> None:
+        self._levels: List[pygame.Surface] = self._build_levels(surf, min_size)
+
+    @staticmethod
+    def _build_levels(surf: pygame.Surface, min_size: int) -> List[pygame.Surface]:
+        levels = [surf]
+        width, height = surf.get_size()
+        while min(width, height) // 2 >= min_size:
+            width, height = width // 2, height // 2
+            levels.append(pygame.transform.smoothscale(levels[-1], (width, height)))
+        return levels
+
+    @property
+    def levels(self) -> List[pygame.Surface]:
+        return self._levels
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self._levels[0].get_size()
+
+    @property
+    def bytes(self) -> int:
+        return sum(surface_bytes(level) for level in self._levels)
+
+    def level_scale(self, index: int) -> float:
+        return self._levels[index].get_width() / self._levels[0].get_width()
+
+    def level_index_for(self, scale: float) -> int:
+        ''' the level of the next power of two at or above scale, the smallest one a residual scale only shrinks '''
+        if scale >= 1.0:
+            return 0
+        index = min(int(math.floor(-math.log2(scale))), len(self._levels) - 1)
+        # compared in pixels, integer halving may leave a level a pixel short of 2 ** -index
+        width, height = self.scaled_size(scale)
+        while index > 0 and (self._levels[index].get_width() < width or self._levels[index].get_height() < height):
+            index -= 1
+        return index
+
+    def scaled_size(self, scale: float) -> Tuple[int, int]:
+        width, height = self.size
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def get(self, scale: float) -> pygame.Surface:
+        level = self._levels[self.level_index_for(scale)]
+        size = self.scaled_size(scale)
+        if level.get_size() == size:
+            return level
+        return pygame.transform.smoothscale(level, size)